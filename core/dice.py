@@ -5,37 +5,514 @@ Pyety: Dice
 """
 
 import random
-from os import linesep
+import re
+from array import array
+from bisect import bisect_left
+from fractions import Fraction
+from functools import lru_cache, partial, reduce
+from itertools import accumulate, chain, repeat
+from math import comb, lcm
+from numbers import Real
+from operator import add, eq, gt, itemgetter, lt
+from hashlib import sha256
+from os import linesep, urandom
+
+
+@lru_cache(maxsize=None)
+def _byte_tables(sides):
+    """
+    Returns a translation table mapping random bytes onto die faces, and the bytes to drop
+    so every face stays equally likely.
+    """
+    limit = 256 - 256 % sides
+    return bytes(b % sides + 1 for b in range(256)), bytes(range(limit, 256)), limit
+
+
+class RandomStream(random.Random):
+    """
+    A seeded pseudo-random generator which can be split into independent substreams.
+    Each stream is identified by the root seed and a path of keys, and fork() derives a
+    child stream's seed by hashing them, so the same seed and keys always produce the same
+    numbers no matter which process, worker or order they are created in.  The state
+    returned by getstate() includes the stream's identity, and streams can be pickled.
+    """
+
+    def __init__(self, seed=None, path=()):
+        if seed is None:  # Pick a seed which can still be logged and replayed.
+            seed = int.from_bytes(urandom(16), "big")
+        self.root = seed
+        self.path = tuple(path)
+        digest = sha256(repr((self.root,) + self.path).encode("utf-8")).digest()
+        super().__init__(int.from_bytes(digest, "big"))
+
+    def fork(self, *keys):
+        """Returns the substream identified by keys, such as a worker number or an entity name."""
+        return RandomStream(self.root, self.path + keys)
+
+    def getstate(self):
+        return (self.root, self.path, super().getstate())
+
+    def setstate(self, state):
+        self.root, self.path, state = state
+        super().setstate(state)
+
+    def spawn(self, count):
+        """Returns count independent substreams, one for each of count workers."""
+        return [self.fork(n) for n in range(count)]
+
+
+class Rolls(object):
+    """
+    A batch of rolls of the same number of dice with the same sides, held as one flat array.
+    Totals, discards and rerolls work across the whole batch at once.
+    """
+
+    __slots__ = ['dice', 'modifier', 'sides', 'source', 'width']
+
+    def __init__(self, source, sides, width, dice, modifier=0):
+        self.dice = dice
+        self.modifier = modifier
+        self.sides = sides
+        self.source = source
+        self.width = width
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Roll index out of range.")
+        return self.dice[index * self.width:(index + 1) * self.width].tolist()
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def __len__(self):
+        return len(self.dice) // self.width if self.width else 0
+
+    def discard(self, num, reverse=False):
+        """Drop the lowest num dice of every roll, or the highest if reverse is True."""
+        num = min(max(int(num), 0), self.width)
+        rows = map(partial(sorted, reverse=reverse), self._rows())
+        dice = array(self.dice.typecode, chain.from_iterable(map(itemgetter(slice(num, None)), rows)))
+        return Rolls(self.source, self.sides, self.width - num, dice, self.modifier)
+
+    def explode(self):
+        """
+        Roll another die for every die showing its highest face and add it to that die,
+        repeating for as long as the extra die also shows its highest face.
+        """
+        if self.sides < 2:
+            raise ValueError("Unable to explode dice with fewer than two sides.")
+        dice = array('l', self.dice)
+        pending = [i for i, d in enumerate(dice) if d == self.sides]
+        while pending:
+            extra = self.source.draw(self.sides, len(pending))
+            for i, die in zip(pending, extra):
+                dice[i] += die
+            pending = [i for i, die in zip(pending, extra) if die == self.sides]
+        return Rolls(self.source, self.sides, self.width, dice, self.modifier)
+
+    def reroll(self, alg=lambda d: d < 2):
+        """Reroll every die, across all rolls, until alg no longer holds for it."""
+        dice = array(self.dice.typecode, self.dice)
+        pending = [i for i, d in enumerate(dice) if alg(d)]
+        while pending:
+            for i, die in zip(pending, self.source.draw(self.sides, len(pending))):
+                dice[i] = die
+            pending = [i for i in pending if alg(dice[i])]
+        return Rolls(self.source, self.sides, self.width, dice, self.modifier)
+
+    def totals(self):
+        """Returns an array with the total of each roll, modifier included."""
+        typecode = 'l' if isinstance(self.modifier, int) else 'd'  # A fractional modifier makes fractional totals.
+        if not self.width:
+            return array(typecode)
+        return array(typecode, map(add, map(sum, self._rows()), repeat(self.modifier)))
+
+    def _rows(self):
+        """Returns an iterator over the dice of each roll."""
+        return zip(*[self.dice[i::self.width] for i in range(self.width)])
+
+
+class Term(object):
+    """A group of identical dice within a dice expression, and what to do with them."""
+
+    __slots__ = ['count', 'explode', 'keep', 'reroll', 'sides', 'sign']
+
+    def __init__(self, sign, count, sides, reroll=None, explode=False, keep=None):
+        self.count = count
+        self.explode = explode
+        self.keep = keep
+        self.reroll = reroll
+        self.sides = sides
+        self.sign = sign
+
+    def distribution(self, depth=8):
+        """
+        Returns the exact probability of each total of this term as a dictionary of
+        total: Fraction.  Exploding dice are followed for up to depth explosions.
+        """
+        die = self._die(depth)
+        # Work in whole number weights over a common denominator, which is much faster.
+        scale = reduce(lcm, (chance.denominator for chance in die.values()), 1)
+        die = dict((face, int(chance * scale)) for face, chance in die.items())
+        if self.keep:
+            num, reverse = self.keep
+            keep = self.count - num
+            # Hand out the dice face by face, starting from the faces which are kept first.
+            # Each state is (dice handed out, total of the kept dice): weight.
+            states = {(0, 0): 1}
+            for face in sorted(die, reverse=not reverse):
+                weight = die[face]
+                after = {}
+                for (placed, total), ways in states.items():
+                    for times in range(self.count - placed + 1):
+                        kept = min(times, max(keep - placed, 0))
+                        key = (placed + times, total + kept * face)
+                        after[key] = after.get(key, 0) + ways * comb(self.count - placed, times) * weight ** times
+                states = after
+            totals = dict((total, ways) for (placed, total), ways in states.items() if placed == self.count)
+        else:
+            totals = {0: 1}
+            for n in range(self.count):
+                totals = _convolve(totals, die)
+        whole = scale ** self.count
+        return dict((self.sign * total, Fraction(ways, whole)) for total, ways in totals.items())
+
+    def _die(self, depth):
+        """Returns the probability of each value of a single die of this term."""
+        faces = [face for face in range(1, self.sides + 1) if not (self.reroll and self.reroll(face))]
+        die = dict((face, Fraction(1, len(faces))) for face in faces)
+        if self.explode and self.sides in die:
+            # An exploded die adds a fresh (not rerolled) roll, which may explode in turn.
+            extra = dict((face, Fraction(1, self.sides)) for face in range(1, self.sides + 1))
+            for n in range(depth - 1):
+                top = extra.pop(self.sides * (n + 1))
+                for face in range(1, self.sides + 1):
+                    extra[self.sides * (n + 1) + face] = top / self.sides
+            top = die.pop(self.sides)
+            for value, chance in extra.items():
+                die[self.sides + value] = top * chance
+        return die
+
+    def roll(self, dice, count):
+        """Returns an array with the total of this term for each of count rolls."""
+        rolls = Rolls(dice, self.sides, self.count, dice.draw(self.sides, self.count * count))
+        if self.reroll:
+            rolls = rolls.reroll(self.reroll)
+        if self.explode:
+            rolls = rolls.explode()
+        if self.keep:
+            rolls = rolls.discard(*self.keep)
+        totals = rolls.totals()
+        if self.sign < 0:
+            totals = array('l', map((0).__sub__, totals))
+        return totals
+
+
+class Plan(object):
+    """
+    A dice expression compiled into the steps needed to roll it.  Plans hold no state
+    of their own, so one plan can be shared by every roll of the same expression.
+    """
+
+    __slots__ = ['constant', 'expression', 'terms']
+
+    def __init__(self, expression, terms, constant=0):
+        self.constant = constant
+        self.expression = expression
+        self.terms = tuple(terms)
+
+    def __repr__(self):
+        return "Plan(%r)" % self.expression
+
+    def distribution(self, depth=8):
+        """
+        Returns the exact probability of each total of the expression as a dictionary of
+        total: Fraction.  Exploding dice are followed for up to depth explosions.
+        """
+        totals = {self.constant: Fraction(1)}
+        for term in self.terms:
+            totals = _convolve(totals, term.distribution(depth))
+        return totals
+
+    def roll(self, dice, count=1):
+        """Roll the expression count times with a Dice object.  Returns an array of totals."""
+        totals = array('l', [self.constant]) * count
+        for term in self.terms:
+            totals = array('l', map(add, totals, term.roll(dice, count)))
+        return totals
+
+
+def _convolve(first, second):
+    """Returns the distribution of the sum of two independent distributions."""
+    totals = {}
+    for a, chance in first.items():
+        for b, other in second.items():
+            totals[a + b] = totals.get(a + b, 0) + chance * other
+    return totals
+
+
+@lru_cache(maxsize=256)
+def _outcomes(expression, depth):
+    """Returns the sorted totals of an expression and the chance of rolling at least each."""
+    table = sorted(parse(expression).distribution(depth).items())
+    totals = [total for total, chance in table]
+    at_least = list(accumulate(reversed([chance for total, chance in table])))
+    at_least.reverse()
+    return totals, at_least
+
+
+def chance(expression, target, depth=8):
+    """
+    Returns the exact chance, as a Fraction, of a dice expression totalling at least target.
+    Outcome tables are computed once per expression and cached.
+    """
+    totals, at_least = _outcomes(expression, depth)
+    position = bisect_left(totals, target)
+    if position == len(totals):
+        return Fraction(0)
+    return at_least[position]
+
+
+def distribution(expression, depth=8):
+    """
+    Returns the exact chance of each total of a dice expression as a dictionary of
+    total: Fraction.  Exploding dice are followed for up to depth explosions; deeper
+    explosions are counted as stopping there.
+    """
+    totals, at_least = _outcomes(expression, depth)
+    return dict((total, at_least[n] - (at_least[n + 1] if n + 1 < len(totals) else 0))
+                for n, total in enumerate(totals))
+
+
+_TERM = re.compile(r"([+-])(?:(\d*)d(\d+|%)((?:[kd][hl]?\d+|r[<>]?\d+|!)*)|(\d+))")
+_OPTION = re.compile(r"(kh|kl|k|dh|dl|d|r<|r>|r)(\d+)|(!)")
+
+
+@lru_cache(maxsize=1024)
+def parse(expression):
+    """
+    Compile a dice expression such as "3d6+2" into a reusable Plan.  Compiled plans are
+    cached by expression.  Each group of dice may be followed by options:
+    khN or kN - keep the highest N dice.         klN - keep the lowest N dice.
+    dhN - drop the highest N dice.               dlN or dN - drop the lowest N dice.
+    rN, r<N, r>N - reroll dice equal to, below or above N until they are not.
+    ! - explode: add another roll to every die showing its highest face.
+    """
+    text = "".join(str(expression).lower().split())
+    if not text.startswith(("+", "-")):
+        text = "+" + text
+    terms = []
+    constant = 0
+    position = 0
+    while position < len(text):
+        match = _TERM.match(text, position)
+        if not match:
+            raise ValueError("Unable to parse dice expression %r." % expression)
+        position = match.end()
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(5):
+            constant += sign * int(match.group(5))
+            continue
+        count = int(match.group(2) or 1)
+        sides = 100 if match.group(3) == "%" else int(match.group(3))
+        if count < 1 or sides < 1:
+            raise ValueError("Dice expression %r has no dice to roll." % expression)
+        term = Term(sign, count, sides)
+        options = match.group(4)
+        at = 0
+        while at < len(options):
+            found = _OPTION.match(options, at)
+            if not found:
+                raise ValueError("Unable to parse dice options %r in %r." % (options[at:], expression))
+            at = found.end()
+            option, value = found.group(1) or found.group(3), found.group(2)
+            if option == "!":
+                if sides < 2:
+                    raise ValueError("Dice expression %r explodes dice with one side." % expression)
+                term.explode = True
+                continue
+            value = int(value)
+            if option.startswith("r"):
+                if option == "r<":
+                    term.reroll, faces = partial(gt, value), range(1, min(value, sides + 1))
+                elif option == "r>":
+                    term.reroll, faces = partial(lt, value), range(max(value + 1, 1), sides + 1)
+                else:
+                    term.reroll, faces = partial(eq, value), range(value, value + 1)
+                if len(faces) >= sides:
+                    raise ValueError("Dice expression %r rerolls every face." % expression)
+                continue
+            if value > count:
+                raise ValueError("Dice expression %r keeps or drops more dice than it rolls." % expression)
+            if option in ("k", "kh"):
+                term.keep = (count - value, False)
+            elif option == "kl":
+                term.keep = (count - value, True)
+            elif option == "dh":
+                term.keep = (value, True)
+            else:
+                term.keep = (value, False)
+        terms.append(term)
+    return Plan(expression, terms, constant)
+
+
+class RollHistory(object):
+    """
+    A bounded history of dice rolls.  The latest limit rolls are kept in a ring buffer,
+    with each roll's dice in a compact array and its sides and modifier in parallel
+    arrays.  Rolls pushed out of the buffer (or cleared) are written to an optional audit
+    log, given as a file name or an open file, which can be read back with replay().
+    """
+
+    __slots__ = ['audit', 'count', 'dice', 'limit', 'modifiers', 'sides', 'start']
+
+    def __init__(self, limit=1000, audit=None):
+        self.limit = int(limit)
+        if self.limit < 1:
+            raise ValueError("Roll history must hold at least one roll.")
+        if isinstance(audit, str):
+            audit = open(audit, "a")
+        self.audit = audit
+        self.clear()
+
+    def __getitem__(self, index):
+        return self.dice[self._slot(index)].tolist()
+
+    def __iter__(self):
+        for n in range(self.count):
+            yield self.dice[(self.start + n) % self.limit].tolist()
+
+    def __len__(self):
+        return self.count
+
+    def __setitem__(self, index, dice):
+        self.dice[self._slot(index)] = self._pack(dice)
+
+    def append(self, dice, sides=0, modifier=0):
+        """Record a roll, pushing the oldest roll out if the history is full."""
+        if not isinstance(modifier, Real):
+            raise TypeError("Invalid dice modifier %r: must be a number." % (modifier,))
+        if not isinstance(modifier, int) and self.modifiers.typecode == 'l':
+            self.modifiers = array('d', self.modifiers)  # Widen to hold fractional modifiers.
+        if self.count == self.limit:
+            self._evict()
+        slot = (self.start + self.count) % self.limit
+        self.dice[slot] = self._pack(dice)
+        self.sides[slot] = sides
+        self.modifiers[slot] = modifier
+        self.count += 1
+
+    def clear(self):
+        """Forget every roll, writing them to the audit log first."""
+        if self.audit is not None:
+            while getattr(self, "count", 0):
+                self._evict()
+        self.count = 0
+        self.dice = [None] * self.limit
+        self.modifiers = array('l', [0]) * self.limit
+        self.sides = array('H', [0]) * self.limit
+        self.start = 0
+
+    def close(self):
+        """Write every roll to the audit log and close it."""
+        if self.audit is not None:
+            self.clear()
+            self.audit.close()
+            self.audit = None
+
+    def getModifier(self, index):
+        """Returns the modifier of a roll."""
+        return self._modifier(self._slot(index))
+
+    def getSides(self, index):
+        """Returns the number of sides of the dice in a roll."""
+        return self.sides[self._slot(index)]
+
+    @staticmethod
+    def replay(stream):
+        """Yields (dice, sides, modifier) for every roll in an audit log, oldest first."""
+        if isinstance(stream, str):
+            with open(stream) as log:
+                yield from RollHistory.replay(log)
+            return
+        for line in stream:
+            sides, modifier, dice = line.rstrip("\n").split("\t")
+            try:
+                modifier = int(modifier)
+            except ValueError:  # A fractional modifier.
+                modifier = float(modifier)
+            yield [int(die) for die in dice.split()], int(sides), modifier
+
+    def _evict(self):
+        """Push the oldest roll out of the history and into the audit log."""
+        slot = self.start
+        if self.audit is not None:
+            self.audit.write("%d\t%s\t%s\n" % (self.sides[slot], self._modifier(slot),
+                                               " ".join(map(str, self.dice[slot]))))
+        self.dice[slot] = None
+        self.start = (slot + 1) % self.limit
+        self.count -= 1
+
+    def _modifier(self, slot):
+        """Returns the modifier in a ring buffer slot, as an int unless it is fractional."""
+        modifier = self.modifiers[slot]
+        return int(modifier) if modifier == int(modifier) else modifier
+
+    def _pack(self, dice):
+        """Returns dice as the most compact array which holds them."""
+        try:
+            return array('H', dice)
+        except OverflowError:  # Dice values are negative or too large.
+            return array('l', dice)
+
+    def _slot(self, index):
+        """Returns the ring buffer slot of a roll."""
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("Roll history index out of range.")
+        return (self.start + index) % self.limit
+
 
 class Dice(object):
-    """Simulate a dice roll"""
+    """
+    Simulate a dice roll.  Dice are drawn from a seedable RandomStream, or from any other
+    random.Random compatible source; pass secure=True to draw from the operating system's
+    random source instead.  A secure source has no state to save or restore, and cannot
+    be seeded.  The latest limit rolls are kept in the roll history (see RollHistory).
+    """
 
-    def __init__(self):
-        try:  # Initialize random seed
-            self._r = random.SystemRandom()
-        except NotImplementedError:  # Use the default randomization if no random number generator available
-            pass
+    def __init__(self, seed=None, secure=False, limit=1000, audit=None, source=None):
+        if seed is not None and (secure or source is not None):
+            raise ValueError("A seed cannot be used with a secure or given random source.")
+        self._r = source if source is not None else RandomStream(seed)
+        if secure:
+            try:  # Initialize random seed
+                self._r = random.SystemRandom()
+            except NotImplementedError:  # Use the default randomization if no random number generator available
+                pass
         # Initialize the dice roll history sequence
-        self.history = []
-        self.sides = []
-        self.roll_mods = []
+        self.history = RollHistory(limit, audit)
 
     def __len__(self):
         return len(self.history)
 
     def __str__(self):
-        strrls = ""
-        for n in range(len(self.history)):
-            strrls = strrls + str(self.total(n - 1)) + linesep
-        return strrls.rstrip()
+        return linesep.join(str(self.total(n)) for n in range(len(self.history)))
 
     @property
     def rolls(self):
-        if not self.history:  # The roll history is empty.
-            all_rolls = []
-        else:
-            all_rolls = self.history
-        return all_rolls
+        return list(self.history)
+
+    @property
+    def roll_mods(self):
+        return [self.history.getModifier(n) for n in range(len(self.history))]
+
+    @property
+    def sides(self):
+        return [self.history.getSides(n) for n in range(len(self.history))]
 
     @property
     def last(self):
@@ -54,6 +531,49 @@ class Dice(object):
         self.historyEdit(index, dice)
         return dice
 
+    def draw(self, sides, total_dice):
+        """Returns an array of total_dice rolls of a die with the given number of sides."""
+        sides = int(sides)
+        total_dice = int(total_dice)
+        if sides < 1 or sides > 65535 or total_dice < 0:
+            raise ValueError("Unable to roll %d dice with %d sides." % (total_dice, sides))
+        if sides > 255:
+            return array('H', self._r.choices(range(1, sides + 1), k=total_dice))
+        # Map whole blocks of random bytes onto die faces, dropping the bytes which would
+        # make the low faces more likely.
+        table, drop, limit = _byte_tables(sides)
+        dice = bytearray()
+        while len(dice) < total_dice:
+            wanted = total_dice - len(dice)
+            dice += self._r.randbytes(wanted * 256 // limit + 16).translate(table, drop)
+        return array('B', dice[:total_dice])
+
+    def evaluate(self, expression, count=None):
+        """
+        Roll a dice expression such as "4d6kh3" (see parse).  Returns the total, or an
+        array of totals when rolling the expression count times.  Expression rolls are not
+        added to the roll history.
+        """
+        totals = parse(expression).roll(self, 1 if count is None else count)
+        if count is None:
+            return totals[0]
+        return totals
+
+    def fork(self, *keys):
+        """
+        Returns new Dice drawing from the substream of this Dice's RandomStream identified by
+        keys, such as a worker number, entity or encounter.  Dice with any other source fork
+        a RandomStream seeded from it, which is only reproducible from the source's state;
+        secure Dice fork more secure Dice.
+        """
+        if isinstance(self._r, RandomStream):
+            source = self._r.fork(*keys)
+        elif isinstance(self._r, random.SystemRandom):
+            return Dice(secure=True, limit=self.history.limit)
+        else:
+            source = RandomStream(self._r.getrandbits(128), keys)
+        return Dice(source=source, limit=self.history.limit)
+
     def getRoll(self, index):
         try:
             roll = self.history[index]
@@ -61,43 +581,66 @@ class Dice(object):
             roll = []
         return roll
 
-    def historyAppend(self, dice):
-        self.history.append(dice)
+    def getState(self):
+        """Returns the state of the random source, which can be given to setState."""
+        try:
+            return self._r.getstate()
+        except NotImplementedError:  # The operating system's random source has no state.
+            raise ValueError("Secure dice have no state to save.")
+
+    def historyAppend(self, dice, sides=0, modifier=0):
+        self.history.append(dice, sides, modifier)
 
     def historyEdit(self, index, dice):
         self.history[index] = dice
 
     def historyClear(self):
         self.history.clear()
-        self.sides.clear()
 
     def reroll(self, index=-1, alg=lambda d: d < 2):
         dice = self.getRoll(index)
         new_dice = []
         for die in dice:
             while alg(die):
-                die = self.roll(self.sides[index], 1, append_to_hist=False)
+                die = self.roll(self.history.getSides(index), 1, append_to_hist=False)
                 die = die[0]
             new_dice.append(die)
         self.historyEdit(index, new_dice)
         return new_dice
 
     def roll(self, sides, total_dice, modifier=0, append_to_hist=True):
-        self.sides.append(sides)
+        if not isinstance(modifier, Real):  # Checked before drawing, so no dice are wasted.
+            raise TypeError("Invalid dice modifier %r: must be a number." % (modifier,))
         try:
-            dice = [self._r.randint(1, sides) for d in range(total_dice)]
-            if dice:
-                if append_to_hist:
-                    self.historyAppend(dice)
-                    self.roll_mods.append(modifier)
-                dice = list(dice)
+            dice = self.draw(sides, total_dice).tolist()
+            if dice and append_to_hist:
+                self.historyAppend(dice, sides, modifier)
         except (ValueError, TypeError):  # Dice roll failed due to invalid data.
             dice = []
         return dice
 
+    def rollMany(self, sides, total_dice, count, modifier=0):
+        """
+        Roll total_dice dice count times in one batch.  Returns a Rolls object, which is not
+        added to the roll history.
+        """
+        return Rolls(self, int(sides), int(total_dice), self.draw(sides, int(total_dice) * int(count)),
+                     modifier)
+
+    def setState(self, state):
+        """Restore the random source to a state returned by getState."""
+        try:
+            self._r.setstate(state)
+        except NotImplementedError:  # The operating system's random source has no state.
+            raise ValueError("Secure dice have no state to restore.")
+
+    @property
+    def source(self):
+        return self._r
+
     def total(self, index=-1):
         try:
-            value = sum(self.history[index]) + self.roll_mods[index]
+            value = sum(self.history[index]) + self.history.getModifier(index)
         except IndexError:  # Roll history index out of range.
             value = 0
         return value
@@ -0,0 +1,154 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: Field of View Module
+
+Works out which cells of a grid each piece can see, treating the surface of each cell
+as clear or opaque, and remembers the answer until something in view changes.
+"""
+
+# Transforms from the first octant into each of the eight octants around a viewer.
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+           (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+class FieldOfView(object):
+    """
+    Works out the cells each piece on a grid can see within a radius, using recursive
+    shadowcasting on the piece's layer.  Cells whose surface icon is in the opaque set
+    block sight (but are themselves visible), as does the edge of the grid.
+
+    Each viewer's field is cached, so asking whether one piece can see another or a
+    location is a set lookup.  The grid is watched, and a field is only dropped when its
+    viewer moves or is deleted, when a cell inside it is painted (a cell no viewer can see
+    cannot change what they see), or when a sparse grid grows past an edge it reaches.
+    """
+
+    __slots__ = ['fields', 'grid', 'opaque', 'radius', 'scope']
+
+    def __init__(self, grid, opaque=("#",), radius=8):
+        self.fields = {}
+        self.grid = grid
+        self.opaque = frozenset(opaque)
+        self.radius = int(radius)
+        self.scope = grid.scope  # The edge of the grid when the cached fields were worked out.
+        grid.watch(self.notify)
+
+    def canSee(self, viewer, target):
+        """Returns True if a piece can see another piece (or a grid location)."""
+        if not isinstance(target, (tuple, list)):
+            target = self.grid.getCoordinates(target)
+            if target is None:  # Target does not exist on grid.
+                return False
+            target = target[0]
+        return tuple(target[:3]) in self.visible(viewer)
+
+    def close(self):
+        """Stop watching the grid for changes."""
+        self.grid.unwatch(self.notify)
+
+    def compute(self, location, radius=None):
+        """Returns the set of grid locations visible from a location."""
+        if not self.grid.index(location):  # Grid location is out of range.
+            return set()
+        radius = self.radius if radius is None else int(radius)
+        x, y, z = location[0], location[1], location[2]
+        seen = {(x, y, z)}
+        scope = self.grid.scope
+        for octant in OCTANTS:
+            self._cast(seen, scope, x, y, z, 1, 1.0, 0.0, radius, octant)
+        return seen
+
+    def invalidate(self, viewer=None):
+        """Forget the field of a viewer, or of every viewer."""
+        if viewer is None:
+            self.fields.clear()
+        else:
+            self.fields.pop(viewer, None)
+
+    def notify(self, event, *args):
+        """Drop the fields a grid change affects.  Meant to be called by the grid."""
+        if self.grid.scope != self.scope:
+            self._grow(self.grid.scope)
+        if event in ("move", "delete"):
+            self.fields.pop(args[0], None)
+        elif event == "paint":
+            start, end = args
+            cells = (end[0] - start[0] + 1) * (end[1] - start[1] + 1) * (end[2] - start[2] + 1)
+            for viewer, field in list(self.fields.items()):
+                if cells < len(field):
+                    hit = any((x, y, z) in field for z in range(start[2], end[2] + 1)
+                              for x in range(start[0], end[0] + 1) for y in range(start[1], end[1] + 1))
+                else:
+                    hit = any(start[0] <= x <= end[0] and start[1] <= y <= end[1] and start[2] <= z <= end[2]
+                              for x, y, z in field)
+                if hit:
+                    del self.fields[viewer]
+        elif event == "clear":
+            self.fields.clear()
+
+    def visible(self, viewer):
+        """Returns the set of grid locations a piece can see."""
+        try:
+            return self.fields[viewer]
+        except KeyError:
+            pass
+        location = self.grid.getCoordinates(viewer)
+        if location is None:  # Viewer does not exist on grid.
+            return frozenset()
+        field = self.fields[viewer] = frozenset(self.compute(location[0]))
+        return field
+
+    def _cast(self, seen, scope, x0, y0, z, row, start, end, radius, octant):
+        """Scan one octant from a row outwards, between two slopes, recursing past obstacles."""
+        if start < end:
+            return
+        xx, xy, yx, yy = octant
+        limit = radius * radius
+        blocked = False
+        resume = start
+        for distance in range(row, radius + 1):
+            dx, dy = -distance - 1, -distance
+            while dx <= 0:
+                dx += 1
+                left, right = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+                if start < right:
+                    continue
+                elif end > left:
+                    break
+                location = (x0 + dx * xx + dy * xy, y0 + dx * yx + dy * yy, z)
+                opaque = self._opacity(location, scope)
+                if opaque is None:  # The edge of the grid blocks sight.
+                    opaque = True
+                elif dx * dx + dy * dy <= limit:
+                    seen.add(location)
+                if blocked:
+                    if opaque:  # Still in shadow.
+                        resume = right
+                        continue
+                    blocked = False
+                    start = resume
+                elif opaque and distance < radius:  # Scan the light beyond the obstacle separately.
+                    blocked = True
+                    self._cast(seen, scope, x0, y0, z, distance + 1, start, left, radius, octant)
+                    resume = right
+            if blocked:
+                break
+
+    def _grow(self, scope):
+        """Drop the fields which reach an edge of the grid that has moved, as it no longer blocks sight."""
+        old = self.scope
+        self.scope = scope
+        if len(old) != 3 or len(scope) != 3 or scope[0] < old[0] or scope[1] < old[1]:
+            self.fields.clear()
+            return
+        wider, longer = scope[0] > old[0], scope[1] > old[1]
+        for viewer, field in list(self.fields.items()):
+            if any((wider and x == old[0]) or (longer and y == old[1]) for x, y, z in field):
+                del self.fields[viewer]
+
+    def _opacity(self, location, scope):
+        """Returns True if a grid location blocks sight, or None if it is off the grid."""
+        if not (0 < location[0] <= scope[0] and 0 < location[1] <= scope[1]):
+            return None
+        return self.grid.store.getSurface(self.grid.index(location)) in self.opaque
@@ -6,7 +6,13 @@ Pyety: Location Module
 Classes which allow object tracking across 2D or 3D space.
 """
 
+from array import array
+from mmap import mmap
+from types import MappingProxyType
 from uuid import uuid4
+
+from core.render import Renderer
+from core.spatial import SpatialHash, line
 from os import linesep
 
 class Cell(object):
@@ -17,10 +23,10 @@ class Cell(object):
     Square/Cube - Length of one side is needed to calculate area and volume.
     Hexagon/Hexagonal prism - Length of one side needed to calculate area.
     Height needed to calculate volume.
+    Calculated measurements are cached until the measurements or formulas change.
     """
 
-    __slots__ = ['area', 'formula', 'height', 'icon', 'length', 'max_objs', 'measurements',
-                 'shape', 'sides', 'volume', 'width']
+    __slots__ = ['cache', 'formula', 'icon', 'max_objs', 'measurements', 'shape', 'sides']
 
     def __init__(self, shape, sides, max_objs=-1):
         try:
@@ -30,6 +36,7 @@ class Cell(object):
             self.measurements = {}
             self.icon = ""
             self.formula = {}
+            self.cache = {}
         except ValueError as err:  # Error initializing grid cell.
             raise ValueError(err)
 
@@ -55,6 +62,10 @@ class Cell(object):
 
     def _calculate(self, formula_type):
         """Calculate measurements."""
+        try:
+            return self.cache[formula_type]
+        except KeyError:  # Measurement has not been calculated yet.
+            pass
         try:
             kwargs = {}
             for m in self.formula[formula_type][0]:
@@ -64,8 +75,13 @@ class Cell(object):
             raise
         except IndexError:  # Unable to calculate cell measurements.
             raise
+        self.cache[formula_type] = value
         return value
 
+    def freeze(self):
+        """Returns a shared, immutable copy of the cell.  See FrozenCell."""
+        return FrozenCell.intern(self)
+
     def setFormula(self, **kwargs):
         """
         Set formulas for various measurements.  Currently, the supported measurements are area, height,
@@ -73,6 +89,7 @@ class Cell(object):
         """
         for k, v in list(kwargs.items()):
             self.formula[k] = v
+        self.cache.clear()
 
     def setIcon(self, icon):
         """Set a default printable icon when the cell is empty."""
@@ -83,6 +100,7 @@ class Cell(object):
         try:
             for k, v in list(kwargs.items()):
                 self.measurements[k] = int(v)
+            self.cache.clear()
             if len(self.measurements) > 0:
                 return True
             else:
@@ -91,22 +109,423 @@ class Cell(object):
             raise
 
 
+class FrozenCell(Cell):
+    """
+    An immutable cell definition with every measurement it has a formula for calculated up
+    front.  Identical definitions are interned, so every grid built from the same cell
+    shares one instance instead of recalculating the same values.
+    """
+
+    __slots__ = ['key']
+
+    interned = {}
+
+    def __init__(self, cell, key):
+        for name, value in (('shape', cell.shape), ('sides', cell.sides), ('max_objs', cell.max_objs),
+                            ('icon', cell.icon), ('measurements', MappingProxyType(dict(cell.measurements))),
+                            ('formula', MappingProxyType(dict(cell.formula))), ('cache', {}), ('key', key)):
+            object.__setattr__(self, name, value)
+        for formula_type in self.formula:
+            try:
+                self._calculate(formula_type)
+            except (IndexError, KeyError, NameError):  # Missing measurement for this formula.
+                pass
+        object.__setattr__(self, 'cache', MappingProxyType(self.cache))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Unable to set attribute %s. The cell is frozen." % name)
+
+    def _calculate(self, formula_type):
+        """Calculate measurements."""
+        try:
+            return self.cache[formula_type]
+        except KeyError:  # Measurement has no formula, or could not be calculated.
+            if isinstance(self.cache, MappingProxyType):
+                raise
+        return Cell._calculate(self, formula_type)
+
+    def freeze(self):
+        """Returns the cell itself, as it is already frozen."""
+        return self
+
+    @classmethod
+    def intern(cls, cell):
+        """Returns the shared frozen copy of a cell definition, creating it if needed."""
+        key = (cell.shape, cell.sides, cell.max_objs, cell.icon, tuple(sorted(cell.measurements.items())),
+               tuple(sorted((k, tuple(v[0]), v[1]) for k, v in cell.formula.items())))
+        try:
+            return cls.interned[key]
+        except KeyError:
+            frozen = cls.interned[key] = cls(cell, key)
+            return frozen
+
+    def setFormula(self, **kwargs):
+        raise AttributeError("Unable to set formulas. The cell is frozen.")
+
+    def setIcon(self, icon):
+        raise AttributeError("Unable to set icon. The cell is frozen.")
+
+    def setMeasurements(self, **kwargs):
+        raise AttributeError("Unable to set measurements. The cell is frozen.")
+
+
+class ListLayers(object):
+    """
+    Stores the surface and content of each grid layer as Python lists, one element per cell.
+    Every cell is allocated up front, which is simple and fast for small grids.
+    """
+
+    __slots__ = ['content', 'scope', 'surface']
+
+    def __init__(self, scope, icon=""):
+        self.scope = scope
+        self.clear(icon)
+
+    def clear(self, icon=""):
+        """Reset every cell to the blank icon with no content."""
+        size = self.scope[0] * self.scope[1]
+        self.surface = [[icon] * size for o in range(self.scope[2])]
+        self.content = [[[] for i in range(size)] for o in range(self.scope[2])]
+
+    def index(self, location):
+        """Calculates the (layer, cell) index of a grid location."""
+        try:
+            x, y, z = location[0], location[1], location[2]
+            if 0 < x <= self.scope[0] and 0 < y <= self.scope[1] and 0 < z <= self.scope[2]:
+                return (z - 1, (x - 1) * self.scope[1] + y - 1)
+        except (IndexError, TypeError):  # Grid index out of range.
+            pass
+        return ()
+
+    def fill(self, start, end, icon):
+        """Paint every cell in the box between two grid locations (inclusive) with an icon."""
+        width = end[1] - start[1] + 1
+        row = [icon] * width
+        for z in range(start[2] - 1, end[2]):
+            layer = self.surface[z]
+            for x in range(start[0] - 1, end[0]):
+                offset = x * self.scope[1] + start[1] - 1
+                layer[offset:offset + width] = row
+
+    def getContent(self, index):
+        """Returns the list of objects in a cell."""
+        return self.content[index[0]][index[1]]
+
+    def getSurface(self, index):
+        """Returns the surface icon of a cell."""
+        return self.surface[index[0]][index[1]]
+
+    def place(self, index, obj):
+        """Append an object to a cell, returning its slot in the cell."""
+        cell = self.content[index[0]][index[1]]
+        cell.append(obj)
+        return len(cell) - 1
+
+    def population(self, layer=None):
+        """Returns the number of objects on one layer, or on the whole grid."""
+        if layer is None:
+            return sum(len(cell) for level in self.content for cell in level)
+        return sum(len(cell) for cell in self.content[layer])
+
+    def remove(self, index, slot):
+        """
+        Remove the object in a cell slot, returning the remaining cell content.  The last
+        object in the cell is swapped into the emptied slot, so no other slots change.
+        """
+        cell = self.content[index[0]][index[1]]
+        last = cell.pop()
+        if slot < len(cell):
+            cell[slot] = last
+        return cell
+
+    def setSurface(self, index, icon):
+        """Set the surface icon of a cell."""
+        self.surface[index[0]][index[1]] = icon
+
+
+class ArrayLayers(ListLayers):
+    """
+    Stores each grid layer in compact typed arrays.  The surface holds integer tile IDs which
+    are looked up in an icon palette, and a parallel array counts the occupants of each cell.
+    Only occupied cells keep a content list, so whole-layer work is done with slice
+    assignment and C-level array operations rather than a Python loop per cell.
+    """
+
+    __slots__ = ['occupancy', 'palette', 'tiles']
+
+    def clear(self, icon=""):
+        """Reset every cell to the blank icon with no content."""
+        size = self.scope[0] * self.scope[1]
+        self.palette = [icon]
+        self.tiles = {icon: 0}
+        self.surface = [array('H', bytes(2 * size)) for o in range(self.scope[2])]
+        self.occupancy = [array('H', bytes(2 * size)) for o in range(self.scope[2])]
+        self.content = [{} for o in range(self.scope[2])]
+
+    def fill(self, start, end, icon):
+        """Paint every cell in the box between two grid locations (inclusive) with an icon."""
+        width = end[1] - start[1] + 1
+        row = array('H', [self.tile(icon)]) * width
+        for z in range(start[2] - 1, end[2]):
+            layer = self.surface[z]
+            if width == self.scope[1]:  # Whole rows are contiguous, so paint them in one slice.
+                layer[(start[0] - 1) * width:end[0] * width] = row * (end[0] - start[0] + 1)
+                continue
+            for x in range(start[0] - 1, end[0]):
+                offset = x * self.scope[1] + start[1] - 1
+                layer[offset:offset + width] = row
+
+    def getContent(self, index):
+        """Returns the list of objects in a cell."""
+        return self.content[index[0]].get(index[1], [])
+
+    def getSurface(self, index):
+        """Returns the surface icon of a cell."""
+        return self.palette[self.surface[index[0]][index[1]]]
+
+    def place(self, index, obj):
+        """Append an object to a cell, returning its slot in the cell."""
+        cell = self.content[index[0]].setdefault(index[1], [])
+        cell.append(obj)
+        self.occupancy[index[0]][index[1]] += 1
+        return len(cell) - 1
+
+    def population(self, layer=None):
+        """Returns the number of objects on one layer, or on the whole grid."""
+        if layer is None:
+            return sum(sum(level) for level in self.occupancy)
+        return sum(self.occupancy[layer])
+
+    def remove(self, index, slot):
+        """
+        Remove the object in a cell slot, returning the remaining cell content.  The last
+        object in the cell is swapped into the emptied slot, so no other slots change.
+        """
+        cells = self.content[index[0]]
+        cell = cells[index[1]]
+        last = cell.pop()
+        if slot < len(cell):
+            cell[slot] = last
+        self.occupancy[index[0]][index[1]] -= 1
+        if not cell:
+            del cells[index[1]]
+        return cell
+
+    def setSurface(self, index, icon):
+        """Set the surface icon of a cell."""
+        self.surface[index[0]][index[1]] = self.tile(icon)
+
+    def tile(self, icon):
+        """Returns the palette tile ID of an icon, adding it to the palette if needed."""
+        try:
+            return self.tiles[icon]
+        except KeyError:
+            if len(self.palette) > 0xFFFF:  # Tile IDs are stored as unsigned 16 bit integers.
+                raise OverflowError("The palette is full: a grid can hold %d different icons." % len(self.palette))
+            self.tiles[icon] = len(self.palette)
+            self.palette.append(icon)
+            return self.tiles[icon]
+
+    @classmethod
+    def wrap(cls, scope, palette, surface):
+        """
+        Returns layers whose surface is an existing sequence of tile ID buffers, one per
+        layer, such as memoryviews of a memory-mapped file, rather than new arrays.
+        """
+        layers = cls.__new__(cls)
+        layers.scope = scope
+        size = scope[0] * scope[1]
+        layers.palette = list(palette)
+        layers.tiles = dict((icon, tile) for tile, icon in enumerate(layers.palette))
+        layers.surface = list(surface)
+        # Anonymous maps are zeroed a page at a time as they are touched, not all up front.
+        layers.occupancy = [memoryview(mmap(-1, 2 * size)).cast('H') for o in range(scope[2])]
+        layers.content = [{} for o in range(scope[2])]
+        return layers
+
+
+class Chunk(object):
+    """A square block of cells on one layer of a ChunkLayers grid."""
+
+    __slots__ = ['content', 'surface']
+
+    def __init__(self, size):
+        self.content = {}
+        self.surface = array('H', bytes(2 * size * size))
+
+
+class ChunkLayers(ArrayLayers):
+    """
+    Stores a sparse grid as fixed size chunks which are only allocated once something is
+    painted or placed in them, so memory grows with the populated part of the world rather
+    than its bounding box.  Locations beyond the initial scope are accepted and extend it.
+    """
+
+    __slots__ = ['chunks', 'chunk_size', 'origin']
+
+    def __init__(self, scope, icon="", chunk_size=16):
+        self.chunk_size = int(chunk_size)
+        self.origin = scope
+        ArrayLayers.__init__(self, scope, icon)
+
+    @property
+    def content(self):
+        """The objects in each cell of each allocated chunk."""
+        return dict((key, chunk.content) for key, chunk in self.chunks.items())
+
+    @property
+    def occupancy(self):
+        """Returns the number of objects in each allocated chunk."""
+        return dict((key, sum(len(cell) for cell in chunk.content.values()))
+                    for key, chunk in self.chunks.items())
+
+    @property
+    def surface(self):
+        """The surface tile IDs of each allocated chunk."""
+        return dict((key, chunk.surface) for key, chunk in self.chunks.items())
+
+    def chunk(self, index):
+        """Returns the chunk holding a cell index, allocating it if needed."""
+        key = index[:3]
+        try:
+            return self.chunks[key]
+        except KeyError:
+            chunk = self.chunks[key] = Chunk(self.chunk_size)
+            return chunk
+
+    def clear(self, icon=""):
+        """Reset every cell to the blank icon with no content."""
+        self.scope = self.origin
+        self.palette = [icon]
+        self.tiles = {icon: 0}
+        self.chunks = {}
+
+    def extend(self, location):
+        """Grow the grid scope to include a location."""
+        if location[0] > self.scope[0] or location[1] > self.scope[1] or location[2] > self.scope[2]:
+            self.scope = tuple(map(max, self.scope, location[:3]))
+
+    def fill(self, start, end, icon):
+        """Paint every cell in the box between two grid locations (inclusive) with an icon."""
+        tile = self.tile(icon)
+        size = self.chunk_size
+        for z in range(start[2] - 1, end[2]):
+            for cx in range((start[0] - 1) // size, (end[0] - 1) // size + 1):
+                rows = range(max(start[0] - 1, cx * size), min(end[0], (cx + 1) * size))
+                for cy in range((start[1] - 1) // size, (end[1] - 1) // size + 1):
+                    low = max(start[1] - 1, cy * size) - cy * size
+                    high = min(end[1], (cy + 1) * size) - cy * size
+                    if tile == 0 and (z, cx, cy) not in self.chunks:
+                        continue  # Nothing to paint over.
+                    surface = self.chunk((z, cx, cy)).surface
+                    row = array('H', [tile]) * (high - low)
+                    for x in rows:
+                        offset = (x - cx * size) * size
+                        surface[offset + low:offset + high] = row
+        self.extend(end)
+
+    def getContent(self, index):
+        """Returns the list of objects in a cell."""
+        offset = index[3]  # An out of range location has an empty index, so raises IndexError.
+        try:
+            return self.chunks[index[:3]].content.get(offset, [])
+        except KeyError:  # Chunk has not been allocated.
+            return []
+
+    def getSurface(self, index):
+        """Returns the surface icon of a cell."""
+        offset = index[3]  # An out of range location has an empty index, so raises IndexError.
+        try:
+            return self.palette[self.chunks[index[:3]].surface[offset]]
+        except KeyError:  # Chunk has not been allocated.
+            return self.palette[0]
+
+    def index(self, location):
+        """Calculates the (layer, chunk row, chunk column, cell) index of a grid location."""
+        try:
+            x, y, z = location[0] - 1, location[1] - 1, location[2] - 1
+            if x >= 0 and y >= 0 and z >= 0:
+                size = self.chunk_size
+                return (z, x // size, y // size, (x % size) * size + y % size)
+        except (IndexError, TypeError):  # Grid index out of range.
+            pass
+        return ()
+
+    def place(self, index, obj):
+        """Append an object to a cell, returning its slot in the cell."""
+        offset = index[3]  # An out of range location has an empty index, so raises IndexError.
+        cell = self.chunk(index).content.setdefault(offset, [])
+        cell.append(obj)
+        self.extend(self.location(index))
+        return len(cell) - 1
+
+    def location(self, index):
+        """Returns the grid location of a cell index."""
+        size = self.chunk_size
+        return (index[1] * size + index[3] // size + 1, index[2] * size + index[3] % size + 1,
+                index[0] + 1)
+
+    def population(self, layer=None):
+        """Returns the number of objects on one layer, or on the whole grid."""
+        return sum(len(cell) for key, chunk in self.chunks.items()
+                   if layer is None or key[0] == layer for cell in chunk.content.values())
+
+    def remove(self, index, slot):
+        """
+        Remove the object in a cell slot, returning the remaining cell content.  The last
+        object in the cell is swapped into the emptied slot, so no other slots change.
+        Chunks left with no content and a blank surface are released.
+        """
+        chunk = self.chunks[index[:3]]
+        cell = chunk.content[index[3]]
+        last = cell.pop()
+        if slot < len(cell):
+            cell[slot] = last
+        if not cell:
+            del chunk.content[index[3]]
+            if not chunk.content and not any(chunk.surface):
+                del self.chunks[index[:3]]
+        return cell
+
+    def setSurface(self, index, icon):
+        """Set the surface icon of a cell."""
+        offset = index[3]  # An out of range location has an empty index, so raises IndexError.
+        tile = self.tile(icon)
+        if tile == 0 and index[:3] not in self.chunks:
+            return  # Cell is already blank.
+        self.chunk(index).surface[offset] = tile
+        self.extend(self.location(index))
+
+
 class Grid(object):
-    """Tracks the location of objects on a grid."""
+    """
+    Tracks the location of objects on a grid.  Passing packed=True stores the grid layers
+    in compact typed arrays (see ArrayLayers) instead of nested lists, while a chunk_size
+    above zero stores a sparse grid in chunks of that size (see ChunkLayers).  The locations
+    of all pieces are also kept in a spatial hash to answer range queries.
+
+    Callbacks registered with watch() are told about every change to the grid as
+    callback(event, *args), where the event and its arguments are one of:
+    "add" (name, location), "delete" (name, location), "move" (name, location, previous),
+    "paint" (start, end) for the inclusive box painted, or "clear" with no arguments.
+    """
 
-    __slots__ = ['area', 'cell', 'content', 'dimensions', 'height', 'idmap', 'layers',
-                 'layer_size', 'length', 'locations', 'objs', 'scope', 'size', 'surface',
-                 'volume', 'uid', 'width']
+    __slots__ = ['cell', 'chunk_size', 'filled', 'idmap', 'locations', 'objs', 'packed', 'spatial',
+                 'store', 'uid', 'volumes', 'watchers']
 
-    def __init__(self, cellobj=None):
+    def __init__(self, cellobj=None, packed=False, chunk_size=0):
         self.cell = cellobj
-        self.content = []
+        self.chunk_size = int(chunk_size)
+        self.filled = {}
         self.idmap = {}
         self.locations = {}
         self.objs = {}
-        self.scope = ()
-        self.surface = []
+        self.packed = packed
+        self.spatial = SpatialHash()
+        self.store = None
         self.uid = uuid4().hex
+        self.volumes = {}
+        self.watchers = []
 
     def __call__(self):
         print(self)
@@ -120,11 +539,19 @@ class Grid(object):
     def area(self):
         """The total area of the grid."""
         try:
-            area = self.cell.area * self.size[0]
-        except (IndexError, TypeError):  # Unable to calculate total area of grid.
+            area = self.cell.area * self.layer_size
+        except (AttributeError, IndexError, KeyError, TypeError):  # Unable to calculate total area of grid.
             area = None
         return area
 
+    @property
+    def content(self):
+        """The objects in each cell of each grid layer."""
+        try:
+            return self.store.content
+        except AttributeError:  # Grid has not been created.
+            return []
+
     @property
     def dimensions(self):
         """The number of dimensions the grid exists in."""
@@ -146,6 +573,14 @@ class Grid(object):
         """Returns the number of grid cells per layer."""
         return self.scope[0] * self.scope[1]
 
+    @property
+    def scope(self):
+        """The number of cells along each axis of the grid."""
+        try:
+            return self.store.scope
+        except AttributeError:  # Grid has not been created.
+            return ()
+
     @property
     def size(self):
         """Returns the total number of grid cells."""
@@ -154,13 +589,21 @@ class Grid(object):
         else:
             return self.scope[0] * self.scope[1]
 
+    @property
+    def surface(self):
+        """The surface of each cell of each grid layer."""
+        try:
+            return self.store.surface
+        except AttributeError:  # Grid has not been created.
+            return []
+
     @property
     def volume(self):
         """The total volume of the grid."""
         if self.layers > 1:
             try:
-                volume = self.cell.volume * self.size[0]
-            except (IndexError, TypeError):  # Unable to calculate total volume of grid.
+                volume = self.cell.volume * self.size
+            except (AttributeError, IndexError, KeyError, TypeError):  # Unable to calculate total volume of grid.
                 volume = 0
             return volume
         else:
@@ -168,18 +611,33 @@ class Grid(object):
 
     def clear(self):
         """Clear the grid of all content"""
-        self.idmap = {}
-        self.objs = {}
-        self.locations = {}
-        if self.cell:
-            icon = self.cell.icon
-        else:
-            icon = ""
-        self.surface = [[icon for i in range(self.size)] for o in range(self.scope[2])]
-        self.content = [[[] for i in range(self.size)] for o in range(self.scope[2])]
+        if self.store:
+            self.store.clear(self.cell.icon if self.cell else "")
+        self._forget()
+
+    def castRay(self, start, end):
+        """
+        Returns the names of the pieces on a straight line from one grid location to another,
+        in the order the line reaches them.  Pieces in the starting cell are not included.
+        """
+        if not self.index(start) or not self.index(end):  # Grid location is out of range.
+            return []
+        names = []
+        for point in line(start, end)[1:]:
+            names.extend(self.idmap[id(obj)] for obj in self.store.getContent(self.index(point)))
+        return names
+
+    def countObjects(self, layer=None):
+        """Returns the number of objects on a grid layer (starting at 1), or on the whole grid."""
+        try:
+            if layer is None:
+                return self.store.population()
+            return self.store.population(int(layer) - 1)
+        except (AttributeError, IndexError, TypeError, ValueError):  # Grid layer is out of range.
+            return 0
 
     def create(self, x, y, z=1):
-        """Create (or overwrite) a grid.  If z=1 then a two dimensional grid is created."""
+        """Create (or overwrite, removing every piece) a grid.  If z=1 then a two dimensional grid is created."""
         try:
             x = int(x)
             y = int(y)
@@ -194,18 +652,20 @@ class Grid(object):
                 icon = self.cell.icon
             else:
                 icon = ""
-            self.scope = (x, y, z)
-            self.surface = [[icon for i in range(size)] for o in range(z)]
-            self.content = [[[] for i in range(size)] for o in range(z)]
+            if self.chunk_size > 0:
+                self.store = ChunkLayers((x, y, z), icon, self.chunk_size)
+            elif self.packed:
+                self.store = ArrayLayers((x, y, z), icon)
+            else:
+                self.store = ListLayers((x, y, z), icon)
+            self._forget()  # Pieces on the old grid are gone with it.
             return True
 
     def getCell(self, location):
         """Get contents of a single grid cell.  Returns a tuple of (surface, content)."""
         index = self.index(location)
         try:
-            bg = self.surface[index[0]][index[1]]
-            fg = self.content[index[0]][index[1]]
-            cell = (bg, fg)
+            cell = (self.store.getSurface(index), self.store.getContent(index))
         except (IndexError, TypeError):  # Grid location is out of range.
             cell = ()
         return cell
@@ -220,84 +680,49 @@ class Grid(object):
 
     def printContent(self):
         """Returns a basic visual representation of a grid's content."""
-        try:
-            #test = self.content[0]
-            grid = "\tGrid Content" + linesep
-            for level in self.content:
-                grid += linesep
-                grid += "\tLevel " + str(level + 1) + ":" + linesep
-                count = 0
-                for cell in self.content[level]:
-                    count += 1
-                    if len(cell) == 1:
-                        text = cell[0]
-                    elif len(cell) > 1:
-                        text = str(len(cell))
-                    else:
-                        text = "-"
-                    grid += "\t" + text
-                    if count % self.scope[1] == 0:
-                        grid += linesep
-        except (AttributeError, IndexError):
-            grid = "The grid is empty."
-        grid += linesep
-        return grid
+        if not self.store:
+            return "The grid is empty." + linesep
+        return "".join(Renderer(self, track=False).lines("content"))
 
     def printSurface(self):
         """Returns a basic visual representation of a grid's surface."""
-        try:
-            #test = self.surface[0]
-            grid = "\tGrid Surface" + linesep
-            for level in self.surface:
-                grid += linesep
-                grid += "\tLevel " + str(level + 1) + ":" + linesep
-                count = 0
-                for cell in self.surface[level]:
-                    count += 1
-                    if not cell:
-                        cell = "-"
-                    grid += "\t" + cell
-                    if count % self.scope[1] == 0:
-                        grid += linesep
-        except (AttributeError, IndexError):
-            grid = "The grid's surface is blank."
-        grid += linesep
-        return grid
+        if not self.store:
+            return "The grid's surface is blank." + linesep
+        return "".join(Renderer(self, track=False).lines("surface"))
 
     def add(self, location, obj, name):
         """
         Add an object to a grid. If no Cell object is defined for this grid each
-        cell may only hold a single object.
+        cell may only hold a single object.  Otherwise a cell holds up to the Cell's
+        max_objs objects (zero or less for no limit), and if the Cell has a volume, the
+        volume attributes of the objects in a cell may not add up to more than it.
         """
         index = self.index(location)
         try:  # Make sure grid index is valid before continuing.
-            cell = self.content[index[0]][index[1]]
-        except (IndexError, TypeError):  # Grid location is out of range.
-            raise
-        if obj in list(self.objs.values()):  # Game piece object already exists in grid.
+            self.store.getContent(index)
+        except (AttributeError, IndexError, TypeError):  # Grid location is out of range.
+            raise IndexError("Grid location %s is out of range." % (location,))
+        if id(obj) in self.idmap:  # Game piece object already exists in grid.
             return False
         elif name in self.locations:  # Named game piece already exists.
             return False
-        else:
-            in_cell = len(cell)
-            if self.cell:
-                if self.cell.volume:
-                    pass
-                elif self.cell.max_objs == 0 or self.cell.max_objs > in_cell:
-                    pass
-                else:
-                    return False
-            else:
-                if in_cell == 0:
-                    self.content[index[0]][index[1]].append(obj)
-                    location = [location, in_cell]
-                    self.idmap[id(obj)] = name
-                    self.locations[name] = location
-                    self.objs[name] = obj
-                    result = name
-                else:  # Each cell may only hold a single object.
-                    return False
-        return result
+        elif not self._room(index, obj):  # Grid cell is full.
+            return False
+        slot = self._place(index, obj, name)  # Record the piece only once it has been placed.
+        self.idmap[id(obj)] = name
+        self.locations[name] = [location, slot]
+        self.objs[name] = obj
+        self.spatial.insert(name, location)
+        self._notify("add", name, location)
+        return name
+
+    def addMany(self, pieces):
+        """
+        Add a sequence of (location, obj, name) entries to a grid in a single pass, such as a
+        spawn table.  Returns a list holding the result of each add.
+        """
+        add = self.add
+        return [add(location, obj, name) for location, obj, name in pieces]
 
     def delete(self, name):
         """Remove an object from a grid."""
@@ -307,49 +732,80 @@ class Grid(object):
         except KeyError:  # Game piece does not exist.
             return False
         try:
-            index = self.index(location[0])
-            del self.content[index][location[1]]
-            for n in range(location[1], len(self.content[index])):
-                opiece = self.content[index][n]
-                oname = self.idmap[id(opiece)]
-                self.locations[oname][1] -= 1
-            del self.locations[name]
-            del self.objs[name]
-            del self.idmap[id(piece)]
-            result = True
+            self._lift(name)
         except (IndexError, TypeError):  # Grid location is out of range.
             return False
-        return result
+        del self.locations[name]
+        del self.objs[name]
+        self.spatial.remove(name)
+        del self.idmap[id(piece)]
+        self._notify("delete", name, location[0])
+        return True
+
+    def inBox(self, start, end):
+        """Returns the names of all pieces in the box between two grid locations (inclusive)."""
+        return self.spatial.inBox(start, end)
+
+    def inRadius(self, location, radius):
+        """Returns the names of all pieces within a straight line distance of a grid location."""
+        return self.spatial.inRadius(location, radius)
+
+    def getName(self, obj):
+        """Get the name a game piece was added to the grid under."""
+        return self.idmap.get(id(obj))
 
     def index(self, location):
         """Calculates list index of a grid cell. Mainly meant for internal use."""
-        if location[0] > self.scope[0] or location[1] > self.scope[1] or location[2] > self.scope[2]:
-            # Grid index out of range.
-            return ()
         try:
-            index = (location[2] - 1, (location[0] - 1) * self.scope[1] + location[1] - 1)
-        except (IndexError, TypeError):  # Grid index out of range.
-            index = ()
-        return index
+            return self.store.index(location)
+        except AttributeError:  # Grid has not been created.
+            return ()
+
+    def lineOfSight(self, start, end):
+        """Returns True if no piece stands on the straight line between two grid locations."""
+        if not self.index(start) or not self.index(end):  # Grid location is out of range.
+            return False
+        for point in line(start, end)[1:-1]:
+            if self.store.getContent(self.index(point)):
+                return False
+        return True
 
     def move(self, name, location):
-        """Move an existing object to a new location on a grid."""
+        """
+        Move an existing object to a new location on a grid.  The object is left where it was
+        if the new location is out of range or has no room for it.
+        """
         try:
             piece = self.objs[name]
+            current = self.locations[name]
         except KeyError:  # Game piece %s does not exist.
             return False
-        new_index = self.index(location)
-        try:  # Make sure grid index is valid before moving on.
-            cell = self.content[new_index]
-        except (IndexError, TypeError):  # Grid location is out of range.
+        index = self.index(location)
+        if not index:  # Grid location is out of range.
+            return False
+        if index == self.index(current[0]):  # Already in the cell.
+            return name
+        if not self._room(index, piece):  # Unable to move object.
             return False
-        result = self.delete(name)
-        if result:
-            result = self.add(location, piece, name)
-        if result:  # Moved object successfully.
-            return result
-        else:  # Unable to move object.
-            return result
+        self._lift(name)
+        previous = current[0]
+        current[0] = location
+        current[1] = self._place(index, piece, name)
+        self.spatial.move(name, location)
+        self._notify("move", name, location, previous)
+        return name
+
+    def moveMany(self, moves):
+        """
+        Move a sequence of (name, location) entries in a single pass, such as every piece
+        acting during a simulation tick.  Returns a list holding the result of each move.
+        """
+        move = self.move
+        return [move(name, location) for name, location in moves]
+
+    def nearest(self, location, k=1):
+        """Returns the names of the k pieces closest to a grid location, nearest first."""
+        return self.spatial.nearest(location, k)
 
     def paint(self, location, piece):
         """
@@ -358,7 +814,101 @@ class Grid(object):
         """
         index = self.index(location)
         try:
-            self.surface[index] = piece
+            self.store.setSurface(index, piece)
         except (IndexError, TypeError):  # Grid location is out of range.
             return False
+        except OverflowError:  # Grid palette has no room for another icon.
+            return False
+        self._notify("paint", location, location)
+        return True
+
+    def paintRegion(self, start, end, piece):
+        """
+        Paint every cell in the box between two grid locations (inclusive) in a single
+        operation per row, rather than painting cell by cell.
+        """
+        if not self.index(start) or not self.index(end):  # Grid location is out of range.
+            return False
+        start, end = tuple(map(min, start, end)), tuple(map(max, start, end))
+        try:
+            self.store.fill(start, end, piece)
+        except TypeError:  # Unable to use piece as a tile.
+            return False
+        except OverflowError:  # Grid palette has no room for another icon.
+            return False
+        self._notify("paint", start, end)
+        return True
+
+    def unwatch(self, callback):
+        """Stop sending grid changes to a callback."""
+        try:
+            self.watchers.remove(callback)
+        except ValueError:  # Callback is not watching the grid.
+            return False
+        return True
+
+    def watch(self, callback):
+        """Send every change made to the grid to a callback."""
+        if callback not in self.watchers:
+            self.watchers.append(callback)
         return True
+
+    def _lift(self, name):
+        """
+        Take a piece out of its cell, update the slot of any piece swapped into its place and
+        release the volume it took up.
+        """
+        location, slot = self.locations[name]
+        index = self.index(location)
+        cell = self.store.remove(index, slot)
+        if slot < len(cell):
+            self.locations[self.idmap[id(cell[slot])]][1] = slot
+        volume = self.volumes.pop(name, 0)
+        if volume:
+            self.filled[index] -= volume
+            if not cell:
+                del self.filled[index]
+
+    def _place(self, index, obj, name):
+        """Put a piece in a cell, recording the volume it takes up.  Returns its slot."""
+        slot = self.store.place(index, obj)
+        volume = self._volume(obj) if self.cell else 0
+        if volume:
+            self.volumes[name] = volume
+            self.filled[index] = self.filled.get(index, 0) + volume
+        return slot
+
+    def _forget(self):
+        """Forget every piece on the grid, and tell watchers that the grid has been cleared."""
+        self.filled = {}
+        self.idmap = {}
+        self.objs = {}
+        self.locations = {}
+        self.spatial.clear()
+        self.volumes = {}
+        self._notify("clear")
+
+    def _notify(self, event, *args):
+        """Tell every watching callback about a change to the grid."""
+        for callback in self.watchers:
+            callback(event, *args)
+
+    def _room(self, index, obj):
+        """Returns True if a grid cell has room for another object."""
+        in_cell = len(self.store.getContent(index))
+        if not self.cell:
+            return in_cell == 0  # Each cell may only hold a single object.
+        if 0 < self.cell.max_objs <= in_cell:
+            return False
+        try:
+            capacity = self.cell.volume
+        except (IndexError, KeyError, NameError):  # No cell volume, so only the objects are counted.
+            return True
+        return self.filled.get(index, 0) + self._volume(obj) <= capacity
+
+    def _volume(self, obj):
+        """Returns the volume an object takes up in a cell."""
+        volume = getattr(obj, "volume", 0)
+        if isinstance(volume, (int, float)):
+            return volume
+        return 0
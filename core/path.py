@@ -0,0 +1,209 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: Path Module
+
+Movement planning across the surface of a grid.
+"""
+
+from collections import OrderedDict
+from heapq import heappop, heappush
+from itertools import count
+
+
+class Pathfinder(object):
+    """
+    Plans movement across a grid, treating the surface of each cell as terrain.  The cost
+    of entering a cell is looked up by its surface icon in a dictionary of costs, and
+    icons with a cost of None are impassable.
+
+    A single piece can be routed with path(), which uses A*.  Pieces sharing a goal should
+    use distances() (a Dijkstra map) or step() (a flow field built from it), which are
+    computed once per goal and cached until the grid's terrain is painted or a sparse grid
+    grows.
+
+    Grids whose Cell has six sides are treated as hexagonal, with every other row shifted
+    half a cell along (so rows 2, 4, 6... sit to the right).  Grids with more than one
+    layer allow moving straight up or down between layers.
+    """
+
+    __slots__ = ['cache_size', 'costs', 'default', 'diagonal', 'grid', 'hexagonal', 'maps',
+                 'minimum', 'paths', 'scope', 'vertical']
+
+    def __init__(self, grid, costs=None, default=1, diagonal=True, vertical=True, cache_size=32):
+        self.cache_size = int(cache_size)
+        self.costs = dict(costs or {})
+        self.default = default
+        self.diagonal = diagonal
+        self.grid = grid
+        self.hexagonal = bool(grid.cell and (grid.cell.sides == 6 or
+                                             grid.cell.shape.lower().startswith("hex")))
+        self.maps = OrderedDict()
+        self.paths = OrderedDict()
+        self.scope = grid.scope  # The edge of the grid when the cached results were worked out.
+        self.vertical = vertical
+        # The cheapest step possible, which keeps the A* estimate from overshooting.
+        passable = [c for c in self.costs.values() if c is not None]
+        self.minimum = min(passable + [default]) if default is not None else min(passable or [0])
+        grid.watch(self.notify)
+
+    def close(self):
+        """Stop watching the grid for terrain changes."""
+        self.grid.unwatch(self.notify)
+
+    def cost(self, location):
+        """Returns the cost of entering a grid location, or None if it cannot be entered."""
+        index = self.grid.index(location)
+        if not index:  # Grid location is out of range.
+            return None
+        return self.costs.get(self.grid.store.getSurface(index), self.default)
+
+    def distances(self, goal, limit=None):
+        """
+        Returns a Dijkstra map: a dictionary of the cost of reaching a goal from every location
+        which can reach it, optionally stopping at a maximum cost.
+        """
+        goal = tuple(goal)
+        key = (goal, limit)
+        try:
+            self.maps.move_to_end(key)
+            return self.maps[key][0]
+        except KeyError:
+            pass
+        costs = {}
+        terrain = {goal: self.cost(goal)}
+        if terrain[goal] is not None:
+            order = count()
+            queue = [(0, next(order), goal)]
+            best = {goal: 0}
+            while queue:
+                total, n, location = heappop(queue)
+                if location in costs:
+                    continue
+                costs[location] = total
+                # Moving here from a neighbour costs whatever it takes to enter this cell.
+                reach = total + terrain[location]
+                if limit is not None and reach > limit:
+                    continue
+                for neighbour in self.neighbours(location):
+                    if neighbour in costs or reach >= best.get(neighbour, reach + 1):
+                        continue
+                    if neighbour not in terrain:
+                        terrain[neighbour] = self.cost(neighbour)
+                    if terrain[neighbour] is not None:
+                        best[neighbour] = reach
+                        heappush(queue, (reach, next(order), neighbour))
+        self._store(self.maps, key, [costs, None])
+        return costs
+
+    def estimate(self, start, goal):
+        """Returns a lower bound on the cost of moving between two grid locations."""
+        climb = abs(start[2] - goal[2])
+        if self.hexagonal:
+            a, b = self._cube(start), self._cube(goal)
+            steps = max(abs(a[0] - b[0]), abs(a[1] - b[1]), abs(a[2] - b[2]))
+        elif self.diagonal:
+            steps = max(abs(start[0] - goal[0]), abs(start[1] - goal[1]))
+        else:
+            steps = abs(start[0] - goal[0]) + abs(start[1] - goal[1])
+        return (steps + climb) * self.minimum
+
+    def flow(self, goal, limit=None):
+        """
+        Returns a flow field: a dictionary of the next location to step to from every location
+        which can reach a goal.
+        """
+        goal = tuple(goal)
+        costs = self.distances(goal, limit)
+        entry = self.maps[(goal, limit)]
+        if entry[1] is None:
+            field = {}
+            for location in costs:
+                if location == goal:
+                    continue
+                field[location] = min((n for n in self.neighbours(location) if n in costs),
+                                      key=lambda n: costs[n] + self.cost(n))
+            entry[1] = field
+        return entry[1]
+
+    def invalidate(self):
+        """Forget every cached path and map."""
+        self.maps.clear()
+        self.paths.clear()
+
+    def neighbours(self, location):
+        """Returns the grid locations next to a location."""
+        x, y, z = location[0], location[1], location[2]
+        if self.hexagonal:
+            shift = 1 if x % 2 == 0 else 0
+            near = [(x, y - 1, z), (x, y + 1, z), (x - 1, y - 1 + shift, z), (x - 1, y + shift, z),
+                    (x + 1, y - 1 + shift, z), (x + 1, y + shift, z)]
+        else:
+            near = [(x - 1, y, z), (x + 1, y, z), (x, y - 1, z), (x, y + 1, z)]
+            if self.diagonal:
+                near += [(x - 1, y - 1, z), (x - 1, y + 1, z), (x + 1, y - 1, z), (x + 1, y + 1, z)]
+        if self.vertical:
+            near += [(x, y, z - 1), (x, y, z + 1)]
+        # Sparse grids accept any location, so keep to the part of the world in use.
+        scope = self.grid.scope
+        return [n for n in near if 0 < n[0] <= scope[0] and 0 < n[1] <= scope[1] and 0 < n[2] <= scope[2]]
+
+    def notify(self, event, *args):
+        """Drop cached results when the terrain or the grid's edge changes.  Meant to be called by the grid."""
+        if event in ("paint", "clear") or self.grid.scope != self.scope:
+            self.scope = self.grid.scope
+            self.invalidate()
+
+    def path(self, start, goal):
+        """
+        Returns the cheapest list of grid locations leading from a start to a goal (both
+        included), or an empty list if the goal cannot be reached.
+        """
+        start, goal = tuple(start), tuple(goal)
+        key = (start, goal)
+        try:
+            self.paths.move_to_end(key)
+            return list(self.paths[key])
+        except KeyError:
+            pass
+        route = []
+        if self.cost(start) is not None and self.cost(goal) is not None:
+            order = count()
+            queue = [(self.estimate(start, goal), next(order), start)]
+            spent = {start: 0}
+            came = {start: None}
+            while queue:
+                guess, n, location = heappop(queue)
+                if location == goal:
+                    while location is not None:
+                        route.append(location)
+                        location = came[location]
+                    route.reverse()
+                    break
+                for neighbour in self.neighbours(location):
+                    cost = self.cost(neighbour)
+                    if cost is None:
+                        continue
+                    total = spent[location] + cost
+                    if total < spent.get(neighbour, total + 1):
+                        spent[neighbour] = total
+                        came[neighbour] = location
+                        heappush(queue, (total + self.estimate(neighbour, goal), next(order), neighbour))
+        self._store(self.paths, key, route)
+        return list(route)
+
+    def step(self, location, goal, limit=None):
+        """Returns the next location on the way to a goal, or None if it cannot be reached."""
+        return self.flow(goal, limit).get(tuple(location))
+
+    def _cube(self, location):
+        """Converts a hexagonal grid location into cube coordinates."""
+        row, column = location[0] - 1, location[1] - 1
+        q = column - (row - (row & 1)) // 2
+        return (q, row, -q - row)
+
+    def _store(self, cache, key, value):
+        """Add a result to a cache, dropping the least recently used result if it is full."""
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
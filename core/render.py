@@ -0,0 +1,129 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: Render Module
+
+Draws grids as text a row at a time, and keeps track of which cells need to be redrawn.
+"""
+
+from os import linesep
+
+
+class Renderer(object):
+    """
+    Renders a grid as rows of text.  Rows are produced by a generator or written straight
+    to a file, so a map is never built up as one long string.  A tracking renderer watches
+    the grid for changes and reports only the cells which changed since the last frame.
+    """
+
+    __slots__ = ['blank', 'dirty', 'full', 'grid', 'separator', 'tracking']
+
+    # Paints covering more cells than this redraw the whole frame rather than each cell.
+    redraw_limit = 4096
+
+    def __init__(self, grid, blank="-", separator="\t", track=True):
+        self.blank = blank
+        self.dirty = set()
+        self.full = True
+        self.grid = grid
+        self.separator = separator
+        self.tracking = track
+        if track:
+            grid.watch(self.notify)
+
+    def cell(self, location, layer=None):
+        """
+        Returns the text for a single grid cell.  The layer may be "surface" or "content";
+        by default a cell's content is drawn over its surface.
+        """
+        index = self.grid.index(location)
+        if layer != "surface":
+            content = self.grid.store.getContent(index)
+            if len(content) == 1:
+                return str(content[0])
+            elif len(content) > 1:
+                return str(len(content))
+            elif layer == "content":
+                return self.blank
+        return str(self.grid.store.getSurface(index) or self.blank)
+
+    def changes(self):
+        """
+        Returns a dictionary of location: text for every cell changed since the last frame,
+        or None if the whole frame must be redrawn, and starts a new frame.
+        """
+        if self.full:
+            cells = None
+        else:
+            cells = dict((location, self.cell(location)) for location in self.dirty
+                         if self.grid.index(location))
+        self.dirty = set()
+        self.full = False
+        return cells
+
+    def close(self):
+        """Stop watching the grid for changes."""
+        if self.tracking:
+            self.grid.unwatch(self.notify)
+            self.tracking = False
+
+    def lines(self, layer=None):
+        """Yields every line of a text report covering each level of the grid."""
+        if layer == "surface":
+            title = "Grid Surface"
+        elif layer == "content":
+            title = "Grid Content"
+        else:
+            title = "Grid"
+        yield self.separator + title + linesep
+        for level in range(1, self.grid.scope[2] + 1):
+            yield linesep
+            yield self.separator + "Level " + str(level) + ":" + linesep
+            for row in self.rows(level, layer=layer):
+                yield row + linesep
+        yield linesep
+
+    def notify(self, event, *args):
+        """Record the cells touched by a grid change.  Meant to be called by the grid."""
+        if event in ("add", "delete"):
+            self.dirty.add(tuple(args[1]))
+        elif event == "move":
+            self.dirty.add(tuple(args[1]))
+            self.dirty.add(tuple(args[2]))
+        elif event == "paint":
+            start, end = args
+            cells = (end[0] - start[0] + 1) * (end[1] - start[1] + 1) * (end[2] - start[2] + 1)
+            if cells > self.redraw_limit:
+                self.full = True
+            else:
+                self.dirty.update((x, y, z) for z in range(start[2], end[2] + 1)
+                                  for x in range(start[0], end[0] + 1)
+                                  for y in range(start[1], end[1] + 1))
+        else:
+            self.full = True
+
+    def render(self, stream, level=1, start=None, end=None, layer=None):
+        """Writes the rows of a grid level, or of a window onto it, to a file-like object."""
+        for row in self.rows(level, start, end, layer):
+            stream.write(row + linesep)
+
+    def rows(self, level=1, start=None, end=None, layer=None):
+        """
+        Yields the rows of a grid level as text, optionally limited to the window between two
+        (x, y) corners.
+        """
+        scope = self.grid.scope
+        if start is None:
+            start = (1, 1)
+        if end is None:
+            end = (scope[0], scope[1])
+        columns = range(max(start[1], 1), min(end[1], scope[1]) + 1)
+        cell = self.cell
+        separator = self.separator
+        for x in range(max(start[0], 1), min(end[0], scope[0]) + 1):
+            yield separator + separator.join([cell((x, y, level), layer) for y in columns])
+
+    def viewport(self, location, width, height):
+        """Returns the (start, end) corners of a window of a given size centred on a location."""
+        start = (location[0] - (height - 1) // 2, location[1] - (width - 1) // 2)
+        return start, (start[0] + height - 1, start[1] + width - 1)
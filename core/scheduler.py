@@ -0,0 +1,184 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: Scheduler Module
+
+The game clock.  Events wait in a priority queue until they are due, so each tick only
+wakes the entities with something to do.
+"""
+
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Event as Flag, RLock
+from time import perf_counter
+
+
+class Event(object):
+    """
+    An action waiting in a Scheduler.  Events due at the same time run in order of
+    priority (highest first, such as initiative), then in the order they were scheduled.
+    """
+
+    __slots__ = ['action', 'args', 'cancelled', 'interval', 'priority', 'scheduler', 'time']
+
+    def __init__(self, time, action, args, priority=0, interval=None):
+        self.action = action
+        self.args = args
+        self.cancelled = False
+        self.interval = interval
+        self.priority = priority
+        self.scheduler = None  # The scheduler whose queue holds the event.
+        self.time = time
+
+    def cancel(self):
+        """Stop the event from running (again)."""
+        if self.scheduler is not None:
+            self.scheduler.cancel(self)
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+    Runs timed events in order of game time, measured in seconds.  An event can be
+    delayed, repeat at an interval, or decide its own next turn: if an action returns a
+    number, the event runs again that many seconds later, or on the next tick if the number
+    is not positive (an action returning None runs once, or at its interval if it has
+    one).  Time only moves forward, a tick at a time, at tick_rate ticks per second, and
+    run() ticks in real time apart from any input loop.  Cancelled events are dropped when
+    they reach the front of the queue, so every operation costs time in proportion to the
+    log of the number of pending events.
+    """
+
+    __slots__ = ['cancelled', 'lock', 'now', 'order', 'queue', 'stopped', 'tick_rate', 'ticks']
+
+    def __init__(self, tick_rate=10):
+        self.cancelled = 0
+        self.lock = RLock()
+        self.now = 0.0
+        self.order = count()
+        self.queue = []
+        self.stopped = Flag()
+        self.tick_rate = tick_rate
+        self.ticks = 0
+
+    def __len__(self):
+        return len(self.queue) - self.cancelled
+
+    @property
+    def due(self):
+        """The game time of the next event, or None if nothing is scheduled."""
+        with self.lock:
+            self._prune()
+            return self.queue[0][0] if self.queue else None
+
+    def advance(self, seconds):
+        """Move game time forward, running every event due on the way.  Returns the number run."""
+        if seconds < 0:
+            raise ValueError("Game time cannot move backwards.")
+        with self.lock:
+            end = self.now + seconds
+            ran = 0
+            while True:
+                self._prune()
+                if not self.queue or self.queue[0][0] > end:
+                    break
+                time, rank, n, event = heappop(self.queue)
+                event.scheduler = None
+                self.now = max(self.now, time)
+                result = event.action(*event.args)
+                ran += 1
+                if event.cancelled:
+                    continue
+                if isinstance(result, (int, float)) and not isinstance(result, bool):
+                    # An event cannot run again before the next tick, or it could run forever.
+                    self._push(event, self.now + result if result > 0 else self._count(end) / self.tick_rate)
+                elif event.interval is not None:
+                    self._push(event, time + event.interval)
+            self.now = end
+            return ran
+
+    def at(self, time, action, *args, priority=0, interval=None):
+        """Schedule an action at a game time.  Returns its Event."""
+        if interval is not None and interval <= 0:
+            raise ValueError("Invalid interval %s: must be more than 0." % interval)
+        event = Event(time, action, args, priority, interval)
+        with self.lock:
+            self._push(event, time)
+        return event
+
+    def cancel(self, event):
+        """Stop an event from running (again)."""
+        with self.lock:
+            if event.cancelled:
+                return
+            event.cancelled = True
+            if event.scheduler is not self:  # Not waiting in the queue, such as while it runs.
+                return
+            self.cancelled += 1
+            # Rebuild the queue once it is mostly cancelled events.
+            if self.cancelled > len(self.queue) // 2:
+                for entry in self.queue:
+                    if entry[3].cancelled:
+                        entry[3].scheduler = None
+                self.queue = [entry for entry in self.queue if not entry[3].cancelled]
+                heapify(self.queue)
+                self.cancelled = 0
+
+    def every(self, interval, action, *args, priority=0, delay=None):
+        """Schedule an action to repeat at an interval, first after a delay (by default the interval)."""
+        return self.schedule(interval if delay is None else delay, action, *args, priority=priority,
+                             interval=interval)
+
+    def run(self, duration=None):
+        """
+        Tick in real time until stop() is called or a game time duration passes.  Ticks
+        which fall behind are caught up at once rather than dropped, so game time keeps
+        pace with the clock.  Meant to be run in its own thread alongside the input loop.
+        """
+        period = 1.0 / self.tick_rate
+        end = None if duration is None else self.now + duration
+        self.stopped.clear()
+        deadline = perf_counter()
+        while not self.stopped.is_set() and (end is None or self.now < end):
+            self.tick()
+            deadline += period
+            delay = deadline - perf_counter()
+            if delay > 0:
+                self.stopped.wait(delay)
+
+    def schedule(self, delay, action, *args, priority=0, interval=None):
+        """Schedule an action after a delay in game seconds.  Returns its Event."""
+        with self.lock:
+            return self.at(self.now + delay, action, *args, priority=priority, interval=interval)
+
+    def stop(self):
+        """Stop run() after the current tick."""
+        self.stopped.set()
+
+    def tick(self):
+        """Move game time forward a single tick.  Returns the number of events run."""
+        with self.lock:
+            # Counted from the current time, so advance() between ticks never moves time back.
+            self.ticks = self._count(self.now)
+            return self.advance(self.ticks / self.tick_rate - self.now)
+
+    def _count(self, time):
+        """Returns the number of the first tick after a game time."""
+        # Tick times are counted rather than summed, so they do not drift.
+        ticks = int(time * self.tick_rate) + 1
+        while ticks / self.tick_rate <= time:  # Rounding put the tick too early.
+            ticks += 1
+        return ticks
+
+    def _prune(self):
+        """Drop cancelled events from the front of the queue."""
+        queue = self.queue
+        while queue and queue[0][3].cancelled:
+            heappop(queue)[3].scheduler = None
+            self.cancelled -= 1
+
+    def _push(self, event, time):
+        """Add an event to the queue."""
+        event.scheduler = self
+        event.time = time
+        heappush(self.queue, (time, -event.priority, next(self.order), event))
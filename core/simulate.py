@@ -0,0 +1,175 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: Simulation Module
+
+Plays out large numbers of encounters across a pool of processes and gathers statistics
+about their results.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import sqrt
+from time import perf_counter
+
+from core.dice import Dice
+from core.location import Grid
+
+
+class Statistics(object):
+    """
+    Running statistics (count, mean, variance, minimum and maximum) for each metric reported
+    by a scenario.  Statistics from separate shards of trials can be merged, so only these
+    totals need to travel back from each worker.
+    """
+
+    __slots__ = ['metrics', 'trials']
+
+    def __init__(self):
+        self.metrics = {}
+        self.trials = 0
+
+    def __getitem__(self, name):
+        count, mean, squares, low, high = self.metrics[name]
+        return {'count': count, 'mean': mean, 'stdev': sqrt(squares / count) if count else 0.0,
+                'min': low, 'max': high}
+
+    def add(self, result):
+        """Add the metrics of a single trial."""
+        self.trials += 1
+        for name, value in result.items():
+            try:
+                count, mean, squares, low, high = self.metrics[name]
+            except KeyError:
+                self.metrics[name] = [1, float(value), 0.0, value, value]
+                continue
+            count += 1
+            delta = value - mean
+            mean += delta / count
+            self.metrics[name] = [count, mean, squares + delta * (value - mean), min(low, value),
+                                  max(high, value)]
+
+    def merge(self, other):
+        """Add the trials summarised by another Statistics object."""
+        self.trials += other.trials
+        for name, (count, mean, squares, low, high) in other.metrics.items():
+            try:
+                mine = self.metrics[name]
+            except KeyError:
+                self.metrics[name] = [count, mean, squares, low, high]
+                continue
+            total = mine[0] + count
+            delta = mean - mine[1]
+            self.metrics[name] = [total, mine[1] + delta * count / total,
+                                  mine[2] + squares + delta * delta * mine[0] * count / total,
+                                  min(mine[3], low), max(mine[4], high)]
+
+    def summary(self):
+        """Returns a dictionary of the statistics for every metric."""
+        return dict((name, self[name]) for name in self.metrics)
+
+
+def _run_shard(scenario, seed, start, stop):
+    """Play trials start to stop of a scenario.  Meant to run in a worker process."""
+    dice = Dice(seed, limit=1)
+    statistics = Statistics()
+    for trial in range(start, stop):
+        statistics.add(scenario(dice.fork(trial), trial))
+    return statistics
+
+
+class Simulation(object):
+    """
+    Plays out a scenario many times, sharding the trials across a ProcessPoolExecutor.
+    A scenario is any picklable callable which takes Dice and a trial number and returns
+    a dictionary of numeric metrics.  Every trial rolls its own substream of the seed, so
+    results do not depend on the number of workers and any trial can be replayed exactly.
+    """
+
+    __slots__ = ['elapsed', 'scenario', 'seed', 'shard_size', 'statistics', 'trials', 'workers']
+
+    def __init__(self, scenario, trials, workers=None, seed=None, shard_size=None):
+        self.elapsed = 0.0
+        self.scenario = scenario
+        self.seed = seed if seed is not None else Dice().source.root
+        self.shard_size = shard_size
+        self.statistics = Statistics()
+        self.trials = int(trials)
+        self.workers = workers
+
+    @property
+    def throughput(self):
+        """Trials completed per second."""
+        return self.statistics.trials / self.elapsed if self.elapsed else 0.0
+
+    def replay(self, trial):
+        """Play a single trial again, returning its metrics."""
+        return self.scenario(Dice(self.seed, limit=1).fork(trial), trial)
+
+    def run(self):
+        """
+        Play every trial, yielding the combined statistics each time a shard finishes.
+        With workers=0 the trials are played in this process.
+        """
+        self.statistics = Statistics()
+        started = perf_counter()
+        # A pool with no worker count uses a process per CPU, so shard for that many.
+        workers = self.workers or os.cpu_count() or 1
+        shard_size = self.shard_size or max(1, min(10000, self.trials // (workers * 8)))
+        shards = [(start, min(start + shard_size, self.trials))
+                  for start in range(0, self.trials, shard_size)]
+        if self.workers == 0:
+            for start, stop in shards:
+                self.statistics.merge(_run_shard(self.scenario, self.seed, start, stop))
+                self.elapsed = perf_counter() - started
+                yield self.statistics
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(_run_shard, self.scenario, self.seed, start, stop)
+                       for start, stop in shards]
+            for future in as_completed(futures):
+                self.statistics.merge(future.result())
+                self.elapsed = perf_counter() - started
+                yield self.statistics
+
+    def summary(self):
+        """Play every trial and return the statistics for every metric."""
+        for statistics in self.run():
+            pass
+        return self.statistics.summary()
+
+
+class Duel(object):
+    """
+    A simple scenario: two fighters start at opposite ends of a corridor, close in a step
+    per round and trade blows once they meet.  Each fighter is described by a dictionary of
+    hp, attack (a dice expression rolled against the other's defence) and damage (a dice
+    expression).  Reports whether the first fighter won and how many rounds it took.
+    """
+
+    __slots__ = ['first', 'length', 'rounds', 'second']
+
+    def __init__(self, first, second, length=10, rounds=100):
+        self.first = first
+        self.length = length
+        self.rounds = rounds
+        self.second = second
+
+    def __call__(self, dice, trial):
+        grid = Grid()
+        grid.create(1, self.length)
+        fighters = [dict(self.first), dict(self.second)]
+        grid.add((1, 1, 1), "A", 0)
+        grid.add((1, self.length, 1), "B", 1)
+        for turn in range(1, self.rounds + 1):
+            for n in (0, 1):
+                me, foe = fighters[n], fighters[1 - n]
+                here = grid.getCoordinates(n)[0]
+                there = grid.getCoordinates(1 - n)[0]
+                if abs(here[1] - there[1]) > 1:
+                    grid.move(n, (1, here[1] + (1 if there[1] > here[1] else -1), 1))
+                elif dice.evaluate(me['attack']) >= foe.get('defence', 10):
+                    foe['hp'] -= max(dice.evaluate(me['damage']), 0)
+                    if foe['hp'] <= 0:
+                        return {'won': 1 - n, 'rounds': turn}
+        return {'won': 0.5, 'rounds': self.rounds}
@@ -0,0 +1,134 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: Spatial Module
+
+A uniform bucket hash which answers range and nearest neighbour queries about the
+pieces on a grid without visiting every cell.
+"""
+
+from itertools import product
+from operator import itemgetter
+
+
+def distance(a, b):
+    """Returns the squared straight line distance between two grid locations."""
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+def line(start, end):
+    """Returns the grid locations on a straight line between two locations, inclusive."""
+    delta = [e - s for s, e in zip(start, end)]
+    steps = max(abs(d) for d in delta)
+    if steps == 0:
+        return [tuple(start)]
+    span = 2 * steps
+    return [tuple(s + (2 * d * i + steps) // span for s, d in zip(start, delta))
+            for i in range(steps + 1)]
+
+
+class SpatialHash(object):
+    """
+    Groups named points into cubic buckets of a fixed size.  Queries only look at the
+    buckets overlapping the area of interest, so their cost depends on how crowded that
+    area is rather than on the number of points tracked.
+    """
+
+    __slots__ = ['bounds', 'buckets', 'points', 'size']
+
+    def __init__(self, size=8):
+        self.size = int(size)
+        self.clear()
+
+    def __contains__(self, name):
+        return name in self.points
+
+    def __len__(self):
+        return len(self.points)
+
+    def bucket(self, location):
+        """Returns the key of the bucket holding a location."""
+        return (location[0] // self.size, location[1] // self.size, location[2] // self.size)
+
+    def clear(self):
+        """Remove every point."""
+        self.bounds = None
+        self.buckets = {}
+        self.points = {}
+
+    def inBox(self, start, end):
+        """Returns the names of all points inside the box between two locations (inclusive)."""
+        low = tuple(map(min, start, end))
+        high = tuple(map(max, start, end))
+        found = []
+        # Bounds may be fractional (such as a radius of 1.5), but bucket keys are whole numbers.
+        for key in product(*(range(int(l // self.size), int(h // self.size) + 1) for l, h in zip(low, high))):
+            for name in self.buckets.get(key, ()):
+                point = self.points[name]
+                if low[0] <= point[0] <= high[0] and low[1] <= point[1] <= high[1] and \
+                        low[2] <= point[2] <= high[2]:
+                    found.append(name)
+        return found
+
+    def inRadius(self, location, radius):
+        """Returns the names of all points within a straight line distance of a location."""
+        reach = (location[0] - radius, location[1] - radius, location[2] - radius)
+        limit = radius * radius
+        return [name for name in self.inBox(reach, (location[0] + radius, location[1] + radius,
+                                                   location[2] + radius))
+                if distance(self.points[name], location) <= limit]
+
+    def insert(self, name, location):
+        """Track a named point, replacing any previous location."""
+        if name in self.points:
+            self.remove(name)
+        key = self.bucket(location)
+        self.points[name] = location
+        self.buckets.setdefault(key, set()).add(name)
+        if self.bounds is None:
+            self.bounds = (key, key)
+        else:
+            self.bounds = (tuple(map(min, self.bounds[0], key)), tuple(map(max, self.bounds[1], key)))
+
+    def move(self, name, location):
+        """Update the location of a tracked point."""
+        key = self.bucket(location)
+        if key == self.bucket(self.points[name]):
+            self.points[name] = location
+        else:
+            self.insert(name, location)
+
+    def nearest(self, location, k=1):
+        """
+        Returns the names of the k points closest to a location, nearest first.  Buckets
+        are searched in rings of growing size until no closer point can remain.
+        """
+        if k < 1 or not self.points:
+            return []
+        centre = self.bucket(location)
+        low, high = self.bounds
+        rings = max(max(abs(c - l), abs(h - c)) for c, l, h in zip(centre, low, high))
+        found = []
+        for ring in range(rings + 1):
+            axes = [range(max(c - ring, l), min(c + ring, h) + 1) for c, l, h in zip(centre, low, high)]
+            for key in product(*axes):
+                if max(abs(a - c) for a, c in zip(key, centre)) != ring:
+                    continue  # Bucket was searched in an earlier ring.
+                for name in self.buckets.get(key, ()):
+                    found.append((distance(self.points[name], location), name))
+            if len(found) >= k:
+                found.sort(key=itemgetter(0))
+                # Points in later rings are at least this far away from the location.
+                reach = ring * self.size
+                if found[k - 1][0] <= reach * reach:
+                    break
+        found.sort(key=itemgetter(0))
+        return [name for dist, name in found[:k]]
+
+    def remove(self, name):
+        """Stop tracking a named point."""
+        key = self.bucket(self.points.pop(name))
+        bucket = self.buckets[key]
+        bucket.discard(name)
+        if not bucket:
+            del self.buckets[key]
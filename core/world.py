@@ -0,0 +1,169 @@
+# pylint: disable=C0103,C0301
+
+"""
+Pyety: World Module
+
+A versioned binary file format for grids.  A world file holds a header (the grid scope
+and cell definition), the surface of every layer as a packed array of tile IDs, and a
+table of where each piece is placed.  Loading memory-maps the file, so the surface is
+paged in as it is used instead of being read up front.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from core.location import ArrayLayers, Cell, ChunkLayers, Grid
+
+MAGIC = b"PYETYWLD"
+VERSION = 1
+
+# Magic, version, byte order (1 for big endian), scope (x, y, z), then the length of the
+# cell definition and palette, the offset of the surface, and the number and offset of
+# the placements.  The placement names and objects follow the placements as JSON.
+HEADER = struct.Struct("<8sHH3I5Q")
+
+logger = logging.getLogger(__name__)
+
+
+def _align(offset, size):
+    """Returns the first offset at or after another which is a multiple of a size."""
+    return -(-offset // size) * size
+
+
+def _layers(store):
+    """Yields the palette, then the surface tile IDs of each layer of a grid's storage."""
+    scope = store.scope
+    size = scope[0] * scope[1]
+    if isinstance(store, ChunkLayers):
+        yield store.palette
+        chunk_size = store.chunk_size
+        for z in range(scope[2]):
+            layer = array('H', bytes(2 * size))
+            for (level, cx, cy), chunk in store.chunks.items():
+                if level != z:
+                    continue
+                for x in range(cx * chunk_size, min((cx + 1) * chunk_size, scope[0])):
+                    width = min(chunk_size, scope[1] - cy * chunk_size)
+                    offset = (x - cx * chunk_size) * chunk_size
+                    layer[x * scope[1] + cy * chunk_size:x * scope[1] + cy * chunk_size + width] = \
+                        chunk.surface[offset:offset + width]
+            yield layer
+    elif isinstance(store, ArrayLayers):
+        yield store.palette
+        for layer in store.surface:
+            yield layer
+    else:
+        palette = []
+        tiles = {}
+        layers = []
+        for level in store.surface:
+            layer = array('H')
+            for icon in level:
+                try:
+                    layer.append(tiles[icon])
+                except KeyError:
+                    tiles[icon] = len(palette)
+                    palette.append(icon)
+                    layer.append(tiles[icon])
+            layers.append(layer)
+        yield palette
+        for layer in layers:
+            yield layer
+
+
+def load(file_name, resolve=None):
+    """
+    Returns the grid stored in a world file, packed into arrays (see ArrayLayers) whose
+    surface is a copy-on-write memory map of the file.  Painting the grid never changes the
+    file.  Pieces are looked up by passing their saved value to resolve, if given; any which
+    cannot be restored are logged as errors and left out.
+    """
+    with open(file_name, "rb") as stream:
+        data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, big, x, y, z, cell_length, palette_length, surface_offset, count, placement_offset = \
+        HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a world file." % file_name)
+    if version > VERSION:
+        raise ValueError("World file version %d is not supported." % version)
+    view = memoryview(data)
+    offset = HEADER.size
+    definition = json.loads(bytes(view[offset:offset + cell_length])) if cell_length else None
+    offset += cell_length
+    palette = json.loads(bytes(view[offset:offset + palette_length]))
+    cell = None
+    if definition:
+        cell = Cell(definition["shape"], definition["sides"], definition["max_objs"])
+        cell.setIcon(definition["icon"])
+        cell.setMeasurements(**definition["measurements"])
+    size = x * y
+    if bool(big) == (sys.byteorder == "big"):
+        surface = [view[surface_offset + 2 * size * level:surface_offset + 2 * size * (level + 1)].cast('H')
+                   for level in range(z)]
+    else:  # Written on a machine of the other byte order, so the tiles must be copied.
+        surface = []
+        for level in range(z):
+            layer = array('H')
+            layer.frombytes(view[surface_offset + 2 * size * level:surface_offset + 2 * size * (level + 1)])
+            layer.byteswap()
+            surface.append(layer)
+    grid = Grid(cell, packed=True)
+    grid.store = ArrayLayers.wrap((x, y, z), palette, surface)
+    if count:
+        locations = array('I')
+        locations.frombytes(view[placement_offset:placement_offset + 12 * count])
+        if bool(big) != (sys.byteorder == "big"):
+            locations.byteswap()
+        pieces = json.loads(bytes(view[placement_offset + 12 * count:]))
+        for n, (name, obj) in enumerate(pieces):
+            location = tuple(locations[3 * n:3 * n + 3])
+            piece = resolve(obj) if resolve else obj
+            if piece is None or grid.add(location, piece, name) is False:
+                logger.error("Unable to restore game piece %s." % name)
+    return grid
+
+
+def save(grid, file_name, ref=None):
+    """
+    Store a grid in a world file.  Each piece is saved as the value ref returns for it, if
+    given, which must be JSON serializable (such as an asset uuid); otherwise pieces are
+    saved as they are.  Cell formulas are not saved.
+    """
+    if grid.store is None:
+        raise ValueError("The grid has not been created.")
+    scope = grid.store.scope
+    cell = grid.cell
+    definition = b""
+    if cell:
+        definition = json.dumps({"shape": cell.shape, "sides": cell.sides, "max_objs": cell.max_objs,
+                                 "icon": cell.icon, "measurements": dict(cell.measurements)}).encode()
+    layers = _layers(grid.store)
+    palette = json.dumps(next(layers), default=str).encode()
+    surface_offset = _align(HEADER.size + len(definition) + len(palette), 8)
+    placement_offset = _align(surface_offset + 2 * scope[0] * scope[1] * scope[2], 4)
+    locations = array('I')
+    pieces = []
+    for name, (location, slot) in grid.locations.items():
+        locations.extend(location[:3])
+        obj = grid.objs[name]
+        pieces.append([name, ref(obj) if ref else obj])
+    # Write a new file rather than truncating the old one, which may be mapped by a loaded grid.
+    temporary = file_name + ".tmp"
+    with open(temporary, "wb") as stream:
+        stream.write(HEADER.pack(MAGIC, VERSION, sys.byteorder == "big", scope[0], scope[1], scope[2],
+                                 len(definition), len(palette), surface_offset, len(pieces), placement_offset))
+        stream.write(definition)
+        stream.write(palette)
+        stream.write(bytes(surface_offset - stream.tell()))
+        for layer in layers:
+            stream.write(layer)
+        stream.write(bytes(placement_offset - stream.tell()))
+        stream.write(locations)
+        stream.write(json.dumps(pieces, default=str).encode())
+    os.replace(temporary, file_name)
+    return True
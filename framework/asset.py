@@ -7,8 +7,10 @@ Defines all the basic functionality for deity game objects, but not specific
 types of objects or what specific data those objects should contain.
 """
 
+import itertools
 import logging
 import uuid
+import weakref
 
 logging.basicConfig(
                     level=logging.INFO,
@@ -17,6 +19,25 @@ logging.basicConfig(
                     )
 logger = logging.getLogger(__name__)
 
+# Integer IDs for schema assets: a random, non-zero 31 bit prefix for each process (so IDs
+# from different sessions do not collide) above a 32 bit counter, so IDs stay cheap to make
+# and fit a signed 64 bit integer, such as an SQLite INTEGER or an array('q').
+_ids = itertools.count((uuid.uuid4().int % 0x7FFFFFFF + 1) << 32 | 1)
+
+# Every asset created or changed, so a save-game journal started later saves them too.
+changed = weakref.WeakSet()
+
+# The dirty set of each open save-game journal: the assets changed since its last checkpoint
+# (see framework.journal).  Each journal has its own, so one checkpoint hides nothing from another.
+trackers = []
+
+
+def touch(asset):
+    """Mark an asset as changed for every save-game journal."""
+    changed.add(asset)
+    for dirty in trackers:
+        dirty.add(asset)
+
 
 def validate(asset, attribs=()):
     if "uuid" not in asset or not asset.uuid:
@@ -56,12 +77,14 @@ class BaseAsset(object):
 
     def __setattr__(self, name, value):
         object.__setattr__(self, name, value)
+        touch(self)
 
     def __delattr__(self, name):
         if name in self.required_attr:
             raise AttributeError("Unable to delete attribute %s. The attribute is required." % name)
         else:
             object.__delattr__(self, name)
+            touch(self)
 
     def __len__(self):
         return len(self.__dict__)
@@ -78,3 +101,116 @@ class BaseAsset(object):
 
     def __call__(self):
         print((self.__str__()))
+
+
+class Schema(type):
+    """
+    Compiles an asset schema into a slotted class.  A schema asset class declares its fields
+    as a dictionary of name: type (or name: (type, default)) and the names of its required
+    fields.  Fields are inherited from schema asset base classes, and required fields
+    missing from the schema are reported when the class is created rather than when each
+    asset is validated.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, "fields", {}))
+        inherited = set(fields)
+        for field, kind in namespace.get("fields", {}).items():
+            fields[field] = kind if isinstance(kind, tuple) else (kind, None)
+        required = tuple(namespace.get("required", ()))
+        for base in bases:
+            required += tuple(r for r in getattr(base, "required_attr", ()) if r not in required)
+        missing = [field for field in required if field not in fields]
+        if missing:
+            raise AttributeError("Schema for %s is missing required attributes: %s" % (name, ", ".join(missing)))
+        namespace["__slots__"] = tuple(field for field in fields if field not in inherited)
+        if not inherited:  # Root schema class: allow weak references for dirty tracking.
+            namespace["__slots__"] += ("__weakref__",)
+        namespace["fields"] = fields
+        namespace["required_attr"] = required
+        namespace.pop("required", None)
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class SchemaAsset(metaclass=Schema):
+    """
+    Base class for assets declared with a schema (see Schema).  Fields are stored in
+    __slots__ instead of a __dict__, each asset gets an integer uuid (unless one is given), and values are
+    converted to their field types when the asset is created.  Unset fields read as None,
+    as on BaseAsset.
+    """
+
+    fields = {"uuid": int}
+
+    def __init__(self, data={}):
+        try:  # Keep the uuid of a saved asset.
+            self.uuid = int(data["uuid"]) if data.get("uuid") is not None else next(_ids)
+        except (TypeError, ValueError) as err:
+            raise AttributeError("Invalid value for attribute uuid: %s" % err)
+        fields = self.fields
+        for name, (kind, default) in fields.items():
+            if name == "uuid":
+                continue
+            try:
+                value = data[name]
+            except KeyError:
+                if default is None:
+                    continue
+                value = default
+            try:
+                object.__setattr__(self, name, value if value is None or isinstance(value, kind) else kind(value))
+            except (TypeError, ValueError) as err:
+                raise AttributeError("Invalid value for attribute %s: %s" % (name, err))
+        unknown = [name for name in data if name not in fields]
+        if unknown:
+            raise AttributeError("Unknown attributes for %s: %s" % (type(self).__name__, ", ".join(unknown)))
+        for name in self.required_attr:
+            if name not in self:
+                raise AttributeError("Required attribute %s is missing." % name)
+        touch(self)
+
+    def __str__(self):
+        data = "Statistics for asset: " + str(self.uuid)
+        for name, value in self:
+            if name == "uuid":
+                continue
+            data += "\n" + name + ":\t\t\t" + str(value)
+        return data
+
+    def __getattr__(self, name):
+        if name in self.fields:  # Field has not been set.
+            return None
+        raise AttributeError("%s has no attribute %s." % (type(self).__name__, name))
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        touch(self)
+
+    def __delattr__(self, name):
+        if name in self.required_attr:
+            raise AttributeError("Unable to delete attribute %s. The attribute is required." % name)
+        else:
+            object.__delattr__(self, name)
+            touch(self)
+
+    def __len__(self):
+        return sum(1 for field in self)
+
+    def __iter__(self):
+        for name in self.fields:
+            try:
+                yield (name, object.__getattribute__(self, name))
+            except AttributeError:  # Field has not been set.
+                continue
+
+    def __contains__(self, key):
+        try:
+            object.__getattribute__(self, key)
+        except AttributeError:
+            return False
+        return key in self.fields
+
+    def __call__(self):
+        print((self.__str__()))
@@ -8,7 +8,7 @@ transport that data to other objects.  It also retrieves data from other objects
 mechanisms.
 """
 
-from ..framework.asset import BaseAsset
+from framework.asset import BaseAsset
 
 
 class Character(BaseAsset):
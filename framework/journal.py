@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+Save-Game Journal
+
+Saves a game as an append-only log of changes.  Each checkpoint appends only the assets
+and grid pieces and cells changed since the last one, so saving takes time in proportion
+to what changed rather than to the size of the world.  The log is compacted into a single
+snapshot from time to time, so loading a game does not replay its whole history.
+"""
+
+import json
+import logging
+import os
+import weakref
+
+from framework import asset
+from framework.utils import _attributes, _create, asset_types
+
+logging.basicConfig(
+                    level=logging.INFO,
+                    format="%(asctime)s %(name)s %(levelname)-8s %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S"
+                    )
+logger = logging.getLogger(__name__)
+
+
+def _covers(outer, inner):
+    """Returns True if one painted box (start, end, icon) lies entirely inside another."""
+    return all(o <= i for o, i in zip(outer[0], inner[0])) and all(o >= i for o, i in zip(outer[1], inner[1]))
+
+
+def _latest(paints):
+    """
+    Returns a list of paints, in order, without those which a later paint covers completely.
+    Paints are checked from the last one back: a single cell only needs looking up among the
+    cells painted after it, so only regions of more than one cell are compared with each other.
+    """
+    cells = set()
+    regions = []
+    kept = []
+    for paint in reversed(paints):
+        if any(_covers(region, paint) for region in regions):
+            continue
+        start, end = tuple(paint[0]), tuple(paint[1])
+        if start == end:
+            if start in cells:
+                continue
+            cells.add(start)
+        else:
+            regions.append(paint)
+        kept.append(paint)
+    kept.reverse()
+    return kept
+
+
+class Journal(object):
+    """
+    Records the changes made to the game's assets and, optionally, a grid in a log file of
+    one JSON record per checkpoint.  Assets are tracked as they are changed (see
+    framework.asset.touch), each journal keeping its own set of changed assets, and the
+    grid is watched for pieces being added, moved or deleted and for its surface being
+    painted.  After compact_after checkpoints the log is rewritten as a single snapshot.
+    Pieces which are neither assets nor JSON serializable cannot be saved.
+    """
+
+    __slots__ = ['cleared', 'compact_after', 'dirty', 'file_name', 'grid', 'names', 'paints', 'records']
+
+    def __init__(self, file_name, grid=None, compact_after=64):
+        self.cleared = False
+        self.compact_after = int(compact_after)
+        self.dirty = weakref.WeakSet(asset.changed)  # Nothing has been saved by this journal yet.
+        asset.trackers.append(self.dirty)
+        self.file_name = file_name
+        self.grid = grid
+        self.names = set()
+        self.paints = []
+        self.records = sum(1 for record in self._records())
+        if grid is not None:
+            grid.watch(self.notify)
+
+    def checkpoint(self):
+        """Append every change since the last checkpoint to the log.  Returns the number of changes."""
+        record = {}
+        assets = list(self.dirty)
+        self.dirty.clear()
+        if assets:
+            record["assets"] = [[str(a.uuid), type(a).__name__, _attributes(a)] for a in assets]
+        if self.cleared:
+            record["clear"] = True
+        if self.names:
+            record["pieces"] = [self._piece(name) for name in self.names]
+        if self.paints:
+            record["paint"] = self.paints
+        if not record:
+            return 0
+        if self.grid is not None and self.grid.store is not None:
+            record["scope"] = list(self.grid.scope)
+        with open(self.file_name, "a") as log:
+            log.write(json.dumps(record, default=str) + "\n")
+        changes = len(assets) + len(self.names) + len(self.paints) + self.cleared
+        self.cleared = False
+        self.names = set()
+        self.paints = []
+        self.records += 1
+        if self.records > self.compact_after:
+            self.compact()
+        return changes
+
+    def close(self):
+        """Stop tracking changed assets and watching the grid for changes."""
+        if self.dirty in asset.trackers:
+            asset.trackers.remove(self.dirty)
+        if self.grid is not None:
+            self.grid.unwatch(self.notify)
+
+    def compact(self):
+        """Rewrite the log as a single record holding the latest state of everything in it."""
+        snapshot = self._merge()
+        temporary = self.file_name + ".tmp"
+        with open(temporary, "w") as log:
+            log.write(json.dumps(snapshot, default=str) + "\n")
+        os.replace(temporary, self.file_name)
+        self.records = 1
+
+    def notify(self, event, *args):
+        """Record a change to the grid.  Meant to be called by the grid."""
+        if event in ("add", "delete", "move"):
+            self.names.add(args[0])
+        elif event == "paint":
+            start, end = args
+            icon = self.grid.store.getSurface(self.grid.index(start))
+            self.paints.append([list(start), list(end), icon])
+        elif event == "clear":
+            self.cleared = True
+            self.names = set()
+            self.paints = []
+
+    def restore(self, types=None):
+        """
+        Load the game saved in the log, returning a dictionary of uuid: asset.  If the journal
+        has a grid its surface is painted and its pieces added; a grid which has not been
+        created yet is created with the saved dimensions.
+        """
+        snapshot = self._merge()
+        if types is None:
+            types = asset_types()
+        assets = {}
+        for uuid, kind, data in snapshot["assets"]:
+            restored = _create(kind, data, types)
+            if restored is not None:
+                assets[uuid] = restored
+                self.dirty.discard(restored)  # Already saved.
+        grid = self.grid
+        if grid is not None:
+            if grid.store is None and snapshot.get("scope"):
+                grid.create(*snapshot["scope"])
+            for start, end, icon in snapshot["paint"]:
+                grid.paintRegion(tuple(start), tuple(end), icon)
+            for name, location, ref in snapshot["pieces"]:
+                piece = assets.get(ref["asset"]) if "asset" in ref else ref["value"]
+                if piece is None or grid.add(tuple(location), piece, name) is False:
+                    logger.error("Unable to restore game piece %s." % name)
+            self.cleared = False
+            self.names = set()
+            self.paints = []
+        return assets
+
+    def _merge(self):
+        """Returns a single record holding the latest state of everything in the log."""
+        assets = {}
+        pieces = {}
+        paints = []
+        scope = None
+        for record in self._records():
+            for entry in record.get("assets", ()):
+                assets[entry[0]] = entry
+            if record.get("clear"):
+                pieces = {}
+                paints = []
+            for entry in record.get("pieces", ()):
+                pieces[json.dumps(entry[0])] = entry
+            paints.extend(record.get("paint", ()))
+            scope = record.get("scope", scope)
+        paints = _latest(paints)
+        snapshot = {"assets": list(assets.values()),
+                    "pieces": [entry for entry in pieces.values() if entry[1] is not None],
+                    "paint": paints}
+        if scope is not None:
+            snapshot["scope"] = scope
+        return snapshot
+
+    def _piece(self, name):
+        """Returns the log entry for a game piece: its name, location (None if deleted) and object."""
+        location = self.grid.getCoordinates(name)
+        if location is None:
+            return [name, None, None]
+        obj = self.grid.objs[name]
+        if isinstance(obj, (asset.BaseAsset, asset.SchemaAsset)):
+            return [name, list(location[0]), {"asset": str(obj.uuid)}]
+        try:
+            json.dumps(obj)
+        except (TypeError, ValueError):  # Piece cannot be saved, so it is left out of the save rather than mangled.
+            logger.error("Unable to save game piece %s: %s is not an asset or JSON serializable." % (name, type(obj).__name__))
+            return [name, None, None]
+        return [name, list(location[0]), {"value": obj}]
+
+    def _records(self):
+        """Yields every record in the log."""
+        try:
+            with open(self.file_name) as log:
+                for line in log:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:  # Nothing has been saved yet.
+            return
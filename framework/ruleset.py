@@ -12,3 +12,118 @@ logging.basicConfig(
                     datefmt="%Y-%m-%d %H:%M:%S"
                     )
 logger = logging.getLogger(__name__)
+
+
+class Rule(object):
+    """
+    A rule which acts on an event, such as "attack", "move" or "enter-cell", happening to
+    an asset of a given class (or any subclass of it).  The rule's conditions and action
+    are called as function(subject, **context) with the details of the event; the action
+    only runs if every condition returns true.
+    """
+
+    __slots__ = ['action', 'conditions', 'event', 'kind', 'name', 'order', 'priority']
+
+    def __init__(self, event, action, kind=object, conditions=(), priority=0, name=None):
+        self.action = action
+        self.conditions = tuple(conditions)
+        self.event = event
+        self.kind = kind
+        self.name = name or getattr(action, "__name__", "rule")
+        self.order = 0
+        self.priority = priority
+
+    def __call__(self, subject, **context):
+        for condition in self.conditions:
+            if not condition(subject, **context):
+                return None
+        return self.action(subject, **context)
+
+
+class Ruleset(object):
+    """
+    Holds the rules of a game and dispatches events to them.  Rules are compiled into a
+    table indexed by event and asset class, and the rules which apply to each event and
+    concrete class (following its method resolution order) are worked out the first time
+    it is fired and then reused.  Firing an event costs one lookup plus the rules which can
+    apply, however many other rules are loaded.  Rules run highest priority first, then in
+    the order they were added.
+    """
+
+    def __init__(self, rules=()):
+        self.compiled = None
+        self.count = 0
+        self.rules = []
+        self.table = {}
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, rule):
+        """Add a rule.  The dispatch table is recompiled the next time an event is fired."""
+        self.count += 1
+        rule.order = self.count
+        self.rules.append(rule)
+        self.compiled = None
+        self.table = {}
+        return rule
+
+    def compile(self):
+        """Build the dispatch table of event: class: rules."""
+        compiled = {}
+        for rule in self.rules:
+            compiled.setdefault(rule.event, {}).setdefault(rule.kind, []).append(rule)
+        self.compiled = compiled
+        self.table = {}
+        logger.debug("Compiled %d rules for %d events." % (len(self.rules), len(compiled)))
+
+    def dispatch(self, event, kind):
+        """Returns the rules which apply to an event happening to an asset class, in the order they run."""
+        try:
+            return self.table[(event, kind)]
+        except KeyError:
+            pass
+        if self.compiled is None:
+            self.compile()
+        kinds = self.compiled.get(event, {})
+        rules = [rule for cls in kind.__mro__ for rule in kinds.get(cls, ())]
+        rules.sort(key=lambda rule: (-rule.priority, rule.order))
+        self.table[(event, kind)] = rules = tuple(rules)
+        return rules
+
+    def fire(self, event, subject, **context):
+        """
+        Apply the rules for an event happening to an asset.  Returns a list of the results
+        of every rule whose conditions passed.
+        """
+        try:
+            rules = self.table[(event, type(subject))]
+        except KeyError:
+            rules = self.dispatch(event, type(subject))
+        results = []
+        for rule in rules:
+            for condition in rule.conditions:
+                if not condition(subject, **context):
+                    break
+            else:
+                results.append(rule.action(subject, **context))
+        return results
+
+    def remove(self, rule):
+        """Remove a rule."""
+        try:
+            self.rules.remove(rule)
+        except ValueError:  # Rule is not in the ruleset.
+            return False
+        self.compiled = None
+        self.table = {}
+        return True
+
+    def rule(self, event, kind=object, *conditions, priority=0, name=None):
+        """Decorator which adds a function as the action of a rule."""
+        def register(action):
+            self.add(Rule(event, action, kind, conditions, priority, name))
+            return action
+        return register
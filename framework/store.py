@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Entity Store
+
+Keeps the numeric attributes of many game assets in typed columns (a struct of arrays),
+so that per-turn updates and queries across every entity run over whole columns at once
+instead of visiting one asset object at a time.
+"""
+
+import logging
+import operator
+from array import array
+from itertools import compress, repeat
+
+logging.basicConfig(
+                    level=logging.INFO,
+                    format="%(asctime)s %(name)s %(levelname)-8s %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S"
+                    )
+logger = logging.getLogger(__name__)
+
+OPERATORS = {'<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne,
+             '>=': operator.ge, '>': operator.gt}
+
+
+class EntityView(object):
+    """
+    A single entity in an EntityStore, behaving like a BaseAsset.  Reading or setting an
+    attribute reads or writes the store, so views are cheap to create and never go stale.
+    """
+
+    __slots__ = ['entity', 'store']
+
+    def __init__(self, store, entity):
+        object.__setattr__(self, 'store', store)
+        object.__setattr__(self, 'entity', entity)
+
+    def __str__(self):
+        data = "Statistics for asset: " + str(self.uuid)
+        for name, value in self:
+            if name == "uuid":
+                continue
+            data += "\n" + name + ":\t\t\t" + str(value)
+        return data
+
+    def __getattr__(self, name):
+        try:
+            return self.store.columns[name][self.entity]
+        except KeyError:
+            return self.store.extras[self.entity].get(name)
+
+    def __setattr__(self, name, value):
+        self.store.setValue(self.entity, name, value)
+
+    def __delattr__(self, name):
+        if name in self.store.columns:
+            raise AttributeError("Unable to delete attribute %s. The attribute is a column." % name)
+        del self.store.extras[self.entity][name]
+
+    def __len__(self):
+        return len(self.store.columns) + len(self.store.extras[self.entity])
+
+    def __iter__(self):
+        for name, column in self.store.columns.items():
+            yield (name, column[self.entity])
+        for name, value in list(self.store.extras[self.entity].items()):
+            yield (name, value)
+
+    def __contains__(self, key):
+        return key in self.store.columns or key in self.store.extras[self.entity]
+
+    def __call__(self):
+        print((self.__str__()))
+
+    @property
+    def kind(self):
+        """The asset class the entity was stored as."""
+        return self.store.kinds[self.store.kind[self.entity]]
+
+
+class EntityStore(object):
+    """
+    Stores entities as rows of typed columns, one column per numeric attribute given as
+    name: typecode (see the array module, e.g. 'l' for integers and 'd' for floats).
+    Any other attributes are kept in a small dictionary per entity.  Entities are
+    numbered from 0, and the numbers of removed entities are reused.
+    """
+
+    def __init__(self, columns):
+        self.alive = array('B')
+        self.columns = dict((name, array(typecode)) for name, typecode in columns.items())
+        self.extras = []
+        self.free = []
+        self.kind = array('H')
+        self.kinds = []
+
+    def __contains__(self, entity):
+        return 0 <= entity < len(self.alive) and bool(self.alive[entity])
+
+    def __getitem__(self, entity):
+        if entity not in self:
+            raise KeyError("Entity %s does not exist." % entity)
+        return EntityView(self, entity)
+
+    def __iter__(self):
+        for entity in compress(range(len(self.alive)), self.alive):
+            yield EntityView(self, entity)
+
+    def __len__(self):
+        return len(self.alive) - len(self.free)
+
+    def add(self, asset, kind=None):
+        """
+        Store an asset, given as a BaseAsset (or anything which iterates as name, value pairs)
+        or a dictionary.  Returns the new entity's number.  Raises ValueError, storing nothing,
+        if a value does not fit its column.
+        """
+        if kind is None:
+            kind = dict if isinstance(asset, dict) else type(asset)
+        # Assets answer None for any missing attribute, so dict() must not look for keys().
+        data = dict(asset.items() if isinstance(asset, dict) else iter(asset))
+        data.pop("required_attr", None)
+        # Convert every column value first, so a bad one leaves the store as it was.
+        values = []
+        for name, column in self.columns.items():
+            try:
+                values.append(array(column.typecode, [data.pop(name, 0)])[0])
+            except (OverflowError, TypeError) as err:
+                raise ValueError("Invalid value for attribute %s: %s" % (name, err))
+        try:
+            code = self.kinds.index(kind)
+        except ValueError:
+            code = len(self.kinds)
+            self.kinds.append(kind)
+        if self.free:
+            entity = self.free.pop()
+            self.alive[entity] = 1
+            self.kind[entity] = code
+            self.extras[entity] = {}
+            for column, value in zip(self.columns.values(), values):
+                column[entity] = value
+        else:
+            entity = len(self.alive)
+            self.alive.append(1)
+            self.kind.append(code)
+            self.extras.append({})
+            for column, value in zip(self.columns.values(), values):
+                column.append(value)
+        self.extras[entity].update(data)
+        return entity
+
+    def apply(self, name, function, *others, ids=None):
+        """
+        Replace a column with function(value, *other values) for every entity, or only for the
+        entities in ids.  Other columns may be named to pass their values in too, e.g.
+        apply('hp', min, 'max_hp') to cap hit points.
+        """
+        column = self.columns[name]
+        if ids is None:
+            values = map(function, column, *[self.columns[other] for other in others])
+            self.columns[name] = array(column.typecode, values)
+            return len(column)
+        for entity in ids:
+            column[entity] = function(column[entity], *[self.columns[other][entity] for other in others])
+        return len(ids)
+
+    def column(self, name):
+        """Returns the array holding a column."""
+        return self.columns[name]
+
+    def fill(self, name, value, ids=None):
+        """Set a column to the same value for every entity, or only for the entities in ids."""
+        column = self.columns[name]
+        if ids is None:
+            self.columns[name] = array(column.typecode, [value]) * len(column)
+        else:
+            for entity in ids:
+                column[entity] = value
+
+    def remove(self, entity):
+        """Remove an entity from the store."""
+        if entity not in self:
+            return False
+        self.alive[entity] = 0
+        self.extras[entity] = {}
+        self.free.append(entity)
+        return True
+
+    def setValue(self, entity, name, value):
+        """Set a single attribute of an entity."""
+        try:
+            self.columns[name][entity] = value
+        except KeyError:
+            self.extras[entity][name] = value
+
+    def where(self, name, op, value, kind=None):
+        """
+        Returns the numbers of every entity whose column compares with a value, such as
+        where('hp', '<', 10), optionally only for entities stored as a given asset class.
+        """
+        matches = map(OPERATORS[op], self.columns[name], repeat(value))
+        selected = map(operator.and_, map(bool, matches), self.alive)
+        if kind is not None:
+            try:
+                code = self.kinds.index(kind)
+            except ValueError:  # No entities of this kind.
+                return []
+            selected = map(operator.and_, selected, map(code.__eq__, self.kind))
+        return list(compress(range(len(self.alive)), selected))
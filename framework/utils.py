@@ -4,11 +4,15 @@
 This script contains a series of generic utility functions.
 """
 
+import json
 import logging
 import os.path
 import sqlite3
-from xml.dom import minidom
-import xml.parsers.expat
+import threading
+from xml.etree import ElementTree
+
+from framework.asset import BaseAsset, SchemaAsset, validate
+from framework.assets import animate, background, void  # Define the standard asset types.
 
 logging.basicConfig(
                     level=logging.INFO,
@@ -17,21 +21,217 @@ logging.basicConfig(
                     )
 logger = logging.getLogger(__name__)
 
+# Converters for the type="..." attribute of XML asset values.  Untyped values are strings.
+CONVERTERS = {"bool": lambda text: text.lower() in ("1", "true", "yes"), "float": float, "int": int,
+              "str": str}
+
+# Asset databases hold one row per asset, with its attributes as JSON.  The uuid is the
+# primary key, so single assets load without a scan.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (uuid TEXT PRIMARY KEY, type TEXT NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS assets_type ON assets (type);
+"""
+
+# Open database connections for each thread, by file name.
+_local = threading.local()
+
+
+def asset_types():
+    """Returns a dictionary of name: class for every BaseAsset and SchemaAsset subclass defined."""
+    types = {}
+    found = [BaseAsset, SchemaAsset]
+    while found:
+        cls = found.pop()
+        types[cls.__name__] = cls
+        found.extend(cls.__subclasses__())
+    return types
+
+
+def close(file_name=None):
+    """Close this thread's connection to an asset database, or to every asset database."""
+    connections = getattr(_local, "connections", {})
+    for name in [file_name] if file_name is not None else list(connections):
+        db = connections.pop(name, None)
+        if db is not None:
+            db.close()
+
+
+def connect(file_name):
+    """
+    Returns this thread's connection to an asset database, creating the database if needed.
+    Connections are kept open and reused, and use write-ahead logging so readers in other
+    threads are not blocked by a save.
+    """
+    connections = _local.__dict__.setdefault("connections", {})
+    try:
+        return connections[file_name]
+    except KeyError:
+        pass
+    db = sqlite3.connect(file_name)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    connections[file_name] = db
+    return db
+
+
+def fetch(file_name, uuid, types=None):
+    """Returns a single asset from an asset database by its uuid, or None."""
+    row = connect(file_name).execute("SELECT type, data FROM assets WHERE uuid = ?", (str(uuid),)).fetchone()
+    if row is None:
+        return None
+    return _create(row[0], json.loads(row[1]), asset_types() if types is None else types)
+
+
+def _attributes(asset):
+    """Returns the attributes of an asset worth storing."""
+    return dict((name, value) for name, value in asset if name != "required_attr")
 
-def load(file_name):
+
+def _create(name, data, types):
+    """Creates and validates an asset of a named type, or returns None."""
+    try:
+        cls = types[name]
+    except KeyError:
+        logger.error("Unknown asset type %s." % name)
+        return None
+    try:
+        asset = cls(data=data)
+    except (AttributeError, TypeError, ValueError) as err:
+        logger.error("Invalid %s asset: %s" % (name, err))
+        return None
+    if isinstance(asset, BaseAsset) and not validate(asset, asset.required_attr):
+        logger.error("Invalid %s asset: missing required attributes." % name)
+        return None
+    return asset
+
+
+def _element(tag, value):
+    """Returns an XML element holding a value, the reverse of _value()."""
+    elem = ElementTree.Element(tag)
+    if isinstance(value, dict):
+        elem.extend(_element(name, item) for name, item in value.items())
+        return elem
+    for kind, name in ((bool, "bool"), (int, "int"), (float, "float")):  # Bools are also ints.
+        if isinstance(value, kind):
+            elem.set("type", name)
+            break
+    elem.text = str(value)
+    return elem
+
+
+def _value(elem):
+    """Returns the value held by an XML element; elements with children become dictionaries."""
+    if len(elem):
+        return dict((child.tag, _value(child)) for child in elem)
+    text = (elem.text or "").strip()
+    kind = elem.get("type")
+    return CONVERTERS[kind](text) if kind else text
+
+
+def _build(elem, types):
+    """Creates and validates an asset from a finished XML element, or returns None."""
+    data = dict(elem.attrib)
+    try:
+        for child in elem:
+            data[child.tag] = _value(child)
+    except (KeyError, ValueError) as err:
+        logger.error("Invalid %s asset: bad value %s" % (elem.tag, err))
+        return None
+    return _create(elem.tag, data, types)
+
+
+def load(file_name, types=None, kind=None):
+    """
+    Yields the game assets stored in a file.  In XML files every child of the root element
+    is an asset, tagged with the name of its asset class, whose children are its attributes:
+
+        <assets>
+            <NonPlayer uuid="...">
+                <name>Goblin</name>
+                <hp type="int">7</hp>
+            </NonPlayer>
+        </assets>
+
+    XML is parsed incrementally and each asset is dropped from the tree once it has been
+    built, so memory use does not grow with the size of the file.  Assets which fail
+    validation are logged and skipped.  Asset classes are looked up by name in types,
+    which defaults to every asset class defined.  Databases may be limited to assets of
+    a single type, named by kind.
+    """
+    if types is None:
+        types = asset_types()
     if os.path.isfile(file_name) and os.path.basename(file_name).endswith(".xml"):
+        depth = 0
+        root = None
         try:  # Try loading game asset data from XML file.
-            xmlobj = minidom.parse(file_name)
-        except xml.parsers.expat.ExpatError as err:
-            logger.error("Unable to parse XML in %s." % file_name)
-            info = {}
+            for event, elem in ElementTree.iterparse(file_name, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if root is None:
+                        root = elem
+                    continue
+                depth -= 1
+                if depth == 1:  # An asset is complete.
+                    asset = _build(elem, types)
+                    root.clear()
+                    if asset is not None and (kind is None or elem.tag == kind):
+                        yield asset
+        except ElementTree.ParseError as err:
+            logger.error("Unable to parse XML in %s: %s" % (file_name, err))
     elif os.path.isfile(file_name) and os.path.basename(file_name).endswith(".db"):
-        db = sqlite3.connect(file_name)  # Load game asset data from sqlite3 database.
+        db = connect(file_name)  # Load game asset data from sqlite3 database.
+        if kind is None:
+            rows = db.execute("SELECT type, data FROM assets")
+        else:
+            rows = db.execute("SELECT type, data FROM assets WHERE type = ?", (kind,))
+        for name, data in rows:
+            asset = _create(name, json.loads(data), types)
+            if asset is not None:
+                yield asset
     else:
         logger.error("Unable to load game data from %s." % file_name)
-        info = {}
-    return info
 
 
-def save(file_name):
-    pass
+def save(file_name, assets):
+    """
+    Store game assets in an XML file (replacing it) or a database (updating any stored
+    assets with the same uuids), returning the number of assets saved.  Assets are written
+    as they are read from the iterable, and a database save is a single transaction, which
+    is rejected with a ValueError (saving nothing) if any uuid belongs to a stored asset of
+    another type.
+    """
+    saved = 0
+    basename = os.path.basename(file_name)
+    if basename.endswith(".db"):
+        total = 0
+
+        def rows():
+            nonlocal total
+            for asset in assets:
+                total += 1
+                yield (str(asset.uuid), type(asset).__name__, json.dumps(_attributes(asset), default=str))
+
+        db = connect(file_name)
+        with db:  # Commits once every asset is written, or rolls back.
+            # A stored asset is only updated by an asset of the same type; a different asset
+            # with the same uuid is left alone, and the whole save is rejected below.
+            saved = db.executemany("INSERT INTO assets (uuid, type, data) VALUES (?, ?, ?) "
+                                   "ON CONFLICT (uuid) DO UPDATE SET data = excluded.data "
+                                   "WHERE type = excluded.type", rows()).rowcount
+            if saved < total:
+                raise ValueError("Unable to save game data to %s: %d assets have uuids belonging to other assets."
+                                 % (file_name, total - saved))
+    elif basename.endswith(".xml"):
+        with open(file_name, "wb") as stream:
+            stream.write(b"<?xml version='1.0' encoding='utf-8'?>\n<assets>\n")
+            for asset in assets:
+                data = _attributes(asset)
+                elem = ElementTree.Element(type(asset).__name__, uuid=str(data.pop("uuid", asset.uuid)))
+                elem.extend(_element(name, value) for name, value in data.items())
+                stream.write(ElementTree.tostring(elem, encoding="utf-8") + b"\n")
+                saved += 1
+            stream.write(b"</assets>\n")
+    else:
+        logger.error("Unable to save game data to %s." % file_name)
+    return saved
@@ -7,10 +7,13 @@ Pyety: RPG Engine
 Main script
 """
 
+import asyncio
 import os
+import sys
 
 import core.util
 import ui.console as uic
+import ui.server as uis
 
 def conf_logger(logger_name, log_dir=None):
     """Configure logging"""
@@ -28,13 +31,25 @@ def run_console():
     con = uic.Console(logger=log)
     con.cmdloop()
 
+def run_server(host="127.0.0.1", port=4000):
+    """Run multi-player server"""
+    log = conf_logger("pyety.server")
+    server = uis.Server(host=host, port=port, logger=log)
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        pass
+
 def run_gui():
     """Run graphical UI"""
     pass
 
 def main():
     """Main function"""
-    run_console()
+    if "--server" in sys.argv[1:]:
+        run_server()
+    else:
+        run_console()
 
 if __name__ == "__main__":
     main()
@@ -8,10 +8,20 @@ import os
 class Console(cmd.Cmd):
     """The Pyety console class implements a simple interactive interface."""
 
-    def __init__(self, prompt="[Pyety]", logger=None):
-        super().__init__()
+    def __init__(self, prompt="[Pyety]", logger=None, journal=None, world=None, stdin=None, stdout=None):
+        super().__init__(stdin=stdin, stdout=stdout)
         self.prompt = prompt + " "
         self.logger = logger
+        self.journal = journal
+        self.world = world
+
+    def ask(self, question):
+        """Ask the user a question, returning their answer."""
+        self.stdout.write(question + " ")
+        self.stdout.flush()
+        if self.use_rawinput:
+            return input()
+        return self.stdin.readline().strip()
 
     def cmdloop(self, intro=None):
         """Override base cmdloop to better customize intro text."""
@@ -28,8 +38,9 @@ class Console(cmd.Cmd):
             elif save == "n" or save == "N":
                 saved = False
             else:
-                print("Do you wish to save your game? (y/n)", end=" ")
-                save = input()
+                save = self.ask("Do you wish to save your game? (y/n)")
+        if saved and self.journal is not None:  # Only changes since the last save are written.
+            self.journal.checkpoint()
         return True
 
     def do_start(self, args):
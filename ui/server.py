@@ -0,0 +1,149 @@
+"""
+Pyety: Engine Server
+
+Hosts many players in one process.  Each connection gets its own console session, and
+every session shares a single world.
+"""
+
+import asyncio
+import io
+import os
+
+from ui.console import Console
+
+
+class NeedInput(Exception):
+    """Raised by a session command which must wait for the player to answer a question."""
+
+
+class Session(Console):
+    """
+    A console session for one connection.  Commands run exactly as they do in Console, but
+    their output is collected and sent to the player instead of printed.  A command which
+    asks a question stops until the answer arrives, and is then run again from the start
+    with the answer ready, so commands should ask their questions before changing anything.
+    """
+
+    def __init__(self, prompt="[Pyety]", logger=None, journal=None, world=None):
+        super().__init__(prompt, logger, journal, world, stdout=io.StringIO())
+        self.answered = 0
+        self.answers = []
+        self.pending = None
+
+    def ask(self, question):
+        """Returns the answer to a question, or sends the question and waits for an answer."""
+        if self.answered < len(self.answers):
+            self.answered += 1
+            return self.answers[self.answered - 1]
+        self.stdout.write(question + " ")
+        raise NeedInput(question)
+
+    def emptyline(self):
+        """Do nothing, rather than repeating the last command."""
+        pass
+
+    def handle(self, line):
+        """
+        Run a line of input, returning the text to send back to the player and whether the
+        session has finished.
+        """
+        self.answered = 0
+        self.stdout = io.StringIO()
+        if self.pending is not None:  # The line answers a question.
+            self.answers.append(line)
+            line = self.pending
+        try:
+            finished = self.onecmd(line)
+        except NeedInput:
+            self.pending = line
+            return self.stdout.getvalue(), False
+        self.answers = []
+        self.pending = None
+        if not finished:
+            self.stdout.write(self.prompt)
+        return self.stdout.getvalue(), bool(finished)
+
+
+class Server(object):
+    """
+    Serves console sessions over TCP, one line of input per command.  Sessions are
+    handled by an asyncio event loop, so a player waiting on input never holds up another
+    player or the world.  A scheduler (see core.scheduler) can be ticked by the same loop
+    to keep the world running between commands.
+    """
+
+    def __init__(self, world=None, host="127.0.0.1", port=0, journal=None, scheduler=None, logger=None,
+                 session=Session, backlog=1024):
+        self.backlog = backlog  # Connections waiting to be accepted, for crowds joining at once.
+        self.clock = None
+        self.host = host
+        self.journal = journal
+        self.logger = logger
+        self.port = port
+        self.scheduler = scheduler
+        self.server = None
+        self.session = session
+        self.sessions = set()
+        self.world = world
+
+    async def close(self):
+        """Stop accepting connections and stop ticking the scheduler."""
+        if self.clock is not None:
+            self.clock.cancel()
+            self.clock = None
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def serve(self, reader, writer):
+        """Run a session for a single connection."""
+        session = self.session(logger=self.logger, journal=self.journal, world=self.world)
+        self.sessions.add(session)
+        peer = writer.get_extra_info("peername")
+        if self.logger:
+            self.logger.info("Session opened for %s." % (peer,))
+        try:
+            writer.write(("Welcome to Pyety!" + os.linesep + session.prompt).encode())
+            await writer.drain()
+            finished = False
+            while not finished:
+                line = await reader.readline()
+                if not line:  # Connection closed.
+                    break
+                output, finished = session.handle(line.decode(errors="replace").strip())
+                writer.write(output.encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):  # Connection lost or line too long.
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+            if self.logger:
+                self.logger.info("Session closed for %s." % (peer,))
+
+    async def start(self):
+        """Start accepting connections.  Returns the (host, port) being served."""
+        self.server = await asyncio.start_server(self.serve, self.host, self.port, backlog=self.backlog)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        if self.scheduler is not None:
+            self.clock = asyncio.ensure_future(self._tick())
+        return self.host, self.port
+
+    async def run(self):
+        """Serve connections until cancelled."""
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _tick(self):
+        """Tick the scheduler at its tick rate, catching up on ticks which fall behind."""
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.scheduler.tick_rate
+        deadline = loop.time()
+        while True:
+            self.scheduler.tick()
+            deadline += period
+            await asyncio.sleep(max(0.0, deadline - loop.time()))